@@ -0,0 +1,510 @@
+'''
+BENCHMARKS
+run with: python benchmark.py <name> [<name> ...]
+e.g.: python benchmark.py mpi numpy_model
+'''
+import sys
+import time
+import random
+
+from libs.othellogame import *
+
+def random_positions(count, plies=(10, 30), seed=0):
+    ''' plays random moves from the starting board to create positions to
+        benchmark on. Returns a list of (board, player to move) pairs '''
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        board = init_board()
+        curr_turn = BLACK
+        for _ in range(rng.randint(*plies)):
+            moves = legalmoves(board, curr_turn)
+            if moves == []:
+                break
+            makemove(board, rng.choice(moves), curr_turn)
+            curr_turn = -curr_turn
+        if legalmoves(board, curr_turn) != []:
+            positions.append((board, curr_turn))
+    return positions
+
+
+''' ENGINES '''
+def engine_times(depth=5, count=6, repeat=20):
+    ''' times legalmoves and a fixed depth AlphaBeta search with the engine 
+        of libs/othellogame (see OTHELLO_BACKEND)
+
+    Returns:
+        dict of 'legalmoves' to positions/sec, of 'games' to the random games
+        played per sec as play.play_match does and of the name of each search 
+        configuration to (secs, nodes)
+    '''
+    from libs.alphabeta import AlphaBeta, MoveOrdering
+    from libs.alphabeta_mpi import count_discs
+    positions = random_positions(count)
+    times = {}
+    time_start = time.time()
+    for _ in range(repeat):
+        for board, player in positions:
+            legalmoves(board, player)
+    times['legalmoves'] = repeat * count / (time.time() - time_start)
+    rng = random.Random(0)
+    time_start = time.time()
+    for _ in range(repeat * 10):
+        board, curr_turn = init_board(), BLACK
+        while True:
+            move2flips = legalmoves_to_flips(board, curr_turn)
+            if not move2flips:
+                break
+            move = rng.choice(list(move2flips))
+            makemove_with_flips(board, move, move2flips[move], curr_turn)
+            curr_turn = -curr_turn
+    times['games'] = repeat * 10 / (time.time() - time_start)
+    flips_kwargs = {
+        'legalmoves_with_flips': legalmoves_with_flips,
+        'makemove_with_flips': makemove_with_flips,
+    }
+    # the configuration of play.alphabeta_kwargs, with and without flips
+    play_kwargs = {
+        'unmakemove': unmakemove,
+        'zobrist_hash': zobrist_hash,
+        'zobrist_update': zobrist_update,
+    }
+    configs = {
+        'legalmoves+makemove': {},
+        'with flips': flips_kwargs,
+        'unmakemove': {'unmakemove': unmakemove},
+        'with flips+unmakemove': dict(flips_kwargs, unmakemove=unmakemove),
+        'play.py': dict(play_kwargs, ordering=MoveOrdering()),
+        'play.py with flips': dict(play_kwargs, ordering=MoveOrdering(),
+            **flips_kwargs),
+    }
+    for name, kwargs in configs.items():
+        searcher = AlphaBeta(legalmoves, makemove, count_discs, 
+            time_limit=3600, **kwargs)
+        nodes = 0
+        time_start = time.time()
+        for board, player in positions:
+            searcher.get_move(board.copy(), player, -player, depth)
+            nodes += searcher.nodes
+        times[name] = (time.time() - time_start, nodes)
+    return times
+
+def bench_engines(depth=5, count=6):
+    ''' compares the list and the bitboard engine, each in a new interpreter
+        since the engine is chosen when libs/othellogame is imported. Both 
+        must search the same number of nodes '''
+    import os
+    import ast
+    import subprocess
+    backend2times = {}
+    for backend in ('list', 'bitboard'):
+        code = (f"import benchmark\n"
+                f"print(benchmark.engine_times({depth}, {count}))")
+        output = subprocess.run([ sys.executable, '-c', code ], check=True,
+            capture_output=True, text=True, 
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=dict(os.environ, OTHELLO_BACKEND=backend)).stdout
+        backend2times[backend] = ast.literal_eval(output.split('\n')[-2])
+    list_times, bit_times = backend2times['list'], backend2times['bitboard']
+    print(f" legalmoves | list {list_times['legalmoves']:>8.0f} | "
+          f"bitboard {bit_times['legalmoves']:>8.0f} positions/sec")
+    print(f" random games | list {list_times['games']:>6.0f} | "
+          f"bitboard {bit_times['games']:>8.0f} games/sec")
+    print(f" {f'search at depth {depth}':<28} | list   | bitboard | nodes")
+    for name in list_times:
+        if name in ('legalmoves', 'games'):
+            continue
+        (list_secs, list_nodes), (bit_secs, bit_nodes) = \
+            list_times[name], bit_times[name]
+        assert list_nodes == bit_nodes, f"{name}: {list_nodes} != {bit_nodes}"
+        print(f" {name:<28} | {list_secs:>6.2f} | {bit_secs:>8.2f} | "
+              f"{list_nodes}")
+
+
+''' PARALLEL SEARCH '''
+def _search_kwargs():
+    if not EAGER_FLIPS:
+        return {'unmakemove': unmakemove}
+    return {
+        'legalmoves_with_flips': legalmoves_with_flips,
+        'makemove_with_flips': makemove_with_flips,
+        'unmakemove': unmakemove,
+    }
+
+def _compare_searches(name2searcher, depths, count):
+    ''' prints the nodes/sec and the move quality of each searcher on the same
+        positions. Move quality is the value of the chosen move according to a
+        full-window AlphaBeta search '''
+    from libs.alphabeta import AlphaBeta
+    from libs.alphabeta_mpi import count_discs
+    def value_of(board, player, move, depth):
+        searcher = AlphaBeta(legalmoves, makemove, count_discs,
+            time_limit=3600, **_search_kwargs())
+        alt = board.copy()
+        makemove(alt, move, player)
+        return searcher.get_value(alt, player, -player, -player, depth)
+    positions = random_positions(count)
+    print(f" depth | engine | nodes/sec | secs   | value of move")
+    for depth in depths:
+        for board, player in positions:
+            for name, searcher in name2searcher.items():
+                time_start = time.time()
+                move = searcher.get_move(board.copy(), player, -player, depth)
+                secs = time.time() - time_start
+                value = value_of(board, player, move, depth)
+                print(f" {depth:>5} | {name:<6} | {searcher.nodes/secs:>9.0f} "
+                      f"| {secs:>6.2f} | {value}")
+
+def bench_mpi(depths=(5, 7), count=3, max_workers=None):
+    ''' compares AlphaBetaMPI against the single process AlphaBeta '''
+    from libs.alphabeta import AlphaBeta, MoveOrdering
+    from libs.alphabeta_mpi import AlphaBetaMPI, count_discs
+    single = AlphaBeta(legalmoves, makemove, count_discs, time_limit=3600,
+        ordering=MoveOrdering(), **_search_kwargs())
+    mpi = AlphaBetaMPI(legalmoves, makemove, count_discs, time_limit=3600,
+        max_workers=max_workers, ordering=MoveOrdering(), **_search_kwargs())
+    mpi._start_workers() # do not time the start of the worker processes
+    _compare_searches({ 'single': single, 'mpi': mpi }, depths, count)
+    mpi.close()
+
+def bench_ybw(depths=(5, 7), count=3, max_workers=None):
+    ''' compares AlphaBetaYBW against AlphaBetaMPI and the single process
+        AlphaBeta '''
+    from libs.alphabeta import AlphaBeta, MoveOrdering
+    from libs.alphabeta_mpi import AlphaBetaMPI, count_discs
+    from libs.alphabeta_ybw import AlphaBetaYBW
+    single = AlphaBeta(legalmoves, makemove, count_discs, time_limit=3600,
+        ordering=MoveOrdering(), **_search_kwargs())
+    mpi = AlphaBetaMPI(legalmoves, makemove, count_discs, time_limit=3600,
+        max_workers=max_workers, ordering=MoveOrdering(), **_search_kwargs())
+    ybw = AlphaBetaYBW(legalmoves, makemove, count_discs, time_limit=3600,
+        max_workers=max_workers, ordering=MoveOrdering(), **_search_kwargs())
+    mpi._start_workers()
+    ybw._start_workers()
+    _compare_searches({ 'single': single, 'mpi': mpi, 'ybw': ybw }, depths, 
+        count)
+    mpi.close()
+    ybw.close()
+
+
+''' MODEL INFERENCE '''
+def _candidate_imgs(count):
+    ''' the images of the boards after every legal move of random positions,
+        like the batches scored by ModelPlayer '''
+    from research import states2imgs
+    imgs = []
+    for board, player in random_positions(count):
+        alts = []
+        for move in legalmoves(board, player):
+            alt = board.copy()
+            makemove(alt, move, player)
+            alts.append(alt)
+        imgs.append(states2imgs(alts, player))
+    return imgs
+
+def _has_tensorflow():
+    ''' whether TensorFlow can be imported, for the benchmarks comparing
+        against keras '''
+    import importlib.util
+    return importlib.util.find_spec('tensorflow') is not None
+
+def bench_numpy_model(count=200, repeat=3):
+    ''' checks that NumpyModel gives the same scores as the keras model it was
+        made from and compares how many positions/sec each can score, both 
+        one batch of candidate moves at a time and all at once. Without 
+        TensorFlow only NumpyModel is timed '''
+    import numpy as np
+    from research import generate_model, random_weights, NumpyModel
+    batches = _candidate_imgs(count)
+    imgs = np.concatenate(batches)
+    if _has_tensorflow():
+        model = generate_model()
+        numpy_model = NumpyModel.from_model(model)
+        diff = numpy_model.check_parity(model, imgs)
+        print(f"max difference from keras: {diff:.2e}")
+        scorers = (('keras', model), ('numpy', numpy_model))
+    else:
+        print(f"TensorFlow is not installed, skipping keras")
+        scorers = (('numpy', NumpyModel(random_weights())),)
+    print(f" model | batching  | positions/sec")
+    for name, scorer in scorers:
+        for batching, inputs in (('per move', batches), ('all', [imgs])):
+            time_start = time.time()
+            for _ in range(repeat):
+                for batch in inputs:
+                    scorer.predict(batch)
+            secs = time.time() - time_start
+            print(f" {name:<5} | {batching:<9} | "
+                  f"{repeat*len(imgs)/secs:>13.0f}")
+
+def bench_eval_cache(pop_size=16, rounds=3, seed=0):
+    ''' plays the same round robin a few times, like the rounds of a 
+        tournament, with and without an EvaluationCache '''
+    import numpy as np
+    from research import (Population, EvaluationCache, state2img, 
+        states2imgs)
+    from players import ModelPlayer
+    from play import play_matches
+    rng = np.random.default_rng(seed)
+    population = Population([
+        [ rng.uniform(-1, 1, size).astype(np.float32) 
+          for size in ((128, 16), 16, (16, 1), 1) ]
+        for _ in range(pop_size)
+    ])
+    matches = [ (i, j) for i in range(pop_size) for j in range(pop_size) 
+                if i != j ]
+    print(f" cache     | secs   | hit rate")
+    for name, cache in (('none', None), ('exact', EvaluationCache()), 
+                        ('symmetric', EvaluationCache(symmetric=True))):
+        players = [ 
+            ModelPlayer(population.agent(i), makemove, state2img, states2imgs,
+                cache=cache)
+            for i in range(pop_size)
+        ]
+        time_start = time.time()
+        for _ in range(rounds):
+            play_matches([ (players[i], players[j]) for i, j in matches ])
+        secs = time.time() - time_start
+        hit_rate = cache.hit_rate() if cache is not None else 0
+        print(f" {name:<9} | {secs:>6.2f} | {hit_rate:.2%}")
+
+
+''' GENETIC OPERATORS '''
+def _keras_mutate(model):
+    ''' experiment2.mutate before the operators worked on weight arrays '''
+    weights = model.get_weights()
+    layer1, _, layer2, _ = weights
+    n = 128*16 + 16
+    for randint in random.sample(list(range(n)), random.randint(1, n-1)):
+        row = randint // 16
+        col = randint % 16
+        if row < 128:
+            layer1[row][col] = random.random() * 2 - 1
+        else:
+            layer2[col] = random.random() * 2 - 1
+    model.set_weights(weights)
+    return model
+
+def _keras_reproduce(mother, father):
+    ''' experiment2.reproduce before the operators worked on weight arrays '''
+    from research import generate_model
+    child = generate_model()
+    child.set_weights(mother.get_weights())
+    c_weights = child.get_weights()
+    c_layer1, _, c_layer2, _ = c_weights
+    f_layer1, _, f_layer2, _ = father.get_weights()
+    for i in range(128):
+        for j in random.sample(range(16), random.randint(0, 15)):
+            c_layer1[i][j] = f_layer1[i][j]
+    for i in random.sample(range(16), random.randint(0, 15)):
+        c_layer2[i] = f_layer2[i]
+    child.set_weights(c_weights)
+    return child
+
+def bench_ga_operators(children=20, batch=1000, seed=0):
+    ''' children/sec of reproduction followed by mutation, with the weight 
+        arrays of one child at a time, with the stacked weights of a whole 
+        batch of children and, if TensorFlow is installed, with keras models 
+        as experiment2 used to '''
+    import numpy as np
+    from research import random_weights, mutate_weights, reproduce_weights
+    rng = np.random.default_rng(seed)
+    m_weights, f_weights = random_weights(rng), random_weights(rng)
+    time_start = time.time()
+    for _ in range(batch):
+        mutate_weights(reproduce_weights(m_weights, f_weights, rng), rng)
+    single_rate = batch / (time.time() - time_start)
+    mothers = [ np.stack([ w ] * batch) for w in m_weights ]
+    fathers = [ np.stack([ w ] * batch) for w in f_weights ]
+    time_start = time.time()
+    mutate_weights(reproduce_weights(mothers, fathers, rng), rng)
+    batch_rate = batch / (time.time() - time_start)
+    print(f" operators      | children/sec")
+    if _has_tensorflow():
+        from research import generate_model
+        mother, father = generate_model(), generate_model()
+        mother.set_weights(m_weights)
+        father.set_weights(f_weights)
+        time_start = time.time()
+        for _ in range(children):
+            _keras_mutate(_keras_reproduce(mother, father))
+        keras_rate = children / (time.time() - time_start)
+        print(f" keras models   | {keras_rate:>12.0f}")
+    else:
+        print(f" keras models   | TensorFlow is not installed, skipped")
+    print(f" weight arrays  | {single_rate:>12.0f}")
+    print(f" stacked arrays | {batch_rate:>12.0f}")
+
+class _Agent(object):
+    ''' an agent of bench_ga_costs, hashed by identity like the weights that
+        experiment1 and experiment2 evolve '''
+    def __init__(self, x):
+        self.x = x
+        self.copied = False
+
+    def __setstate__(self, state):
+        # the agents sent to and back from worker processes are copies
+        self.__dict__.update(state, copied=True)
+
+def _agent_cost(agent):
+    return (agent.x - 0.3) ** 2
+
+def _population_cost(agents):
+    return { agent: _agent_cost(agent) for agent in agents }
+
+def _mutate_agent(agent):
+    return _Agent(agent.x * 0.9 + 0.01)
+
+def _reproduce_agents(mother, father):
+    return _Agent((mother.x + father.x) / 2)
+
+def bench_ga_costs(pop_size=40, generations=8, seed=0):
+    ''' secs of GA.evolve with costs of single agents, of batches and of the
+        whole population, computed serially, by threads and by processes. The
+        processes are sent copies of the agents, so every way must still end
+        with the same costs of the agents of the population, not the copies '''
+    import io
+    import contextlib
+    import concurrent.futures
+    from libs.GA import evolve
+    configs = {
+        'agent': {},
+        'batched': { 'population_cost': True, 'batch_size': 8 },
+        'population': { 'population_cost': True },
+    }
+    executors = {
+        'serial': contextlib.nullcontext,
+        'threads': lambda: concurrent.futures.ThreadPoolExecutor(4),
+        'processes': lambda: concurrent.futures.ProcessPoolExecutor(4),
+    }
+    print(f" cost       | executor  | secs")
+    for name, kwargs in configs.items():
+        cost = _population_cost if kwargs else _agent_cost
+        expected = None
+        for executor_name, make_executor in executors.items():
+            rng = random.Random(seed)
+            population = [ _Agent(rng.random()) for _ in range(pop_size) ]
+            time_start = time.time()
+            # evolve prints every generation
+            with make_executor() as executor, \
+                    contextlib.redirect_stdout(io.StringIO()):
+                agent2cost = evolve(population, cost, _mutate_agent,
+                    _reproduce_agents, generations=generations,
+                    executor=executor, random_seed=seed, **kwargs)
+            secs = time.time() - time_start
+            assert not any(agent.copied for agent in agent2cost), \
+                f"{name}, {executor_name}: agents swapped for copies"
+            result = [ (agent.x, c) for agent, c in agent2cost.items() ]
+            if expected is None:
+                expected = result
+            assert result == expected, f"{name}, {executor_name}: {result}"
+            print(f" {name:<10} | {executor_name:<9} | {secs:>5.2f}")
+
+''' BATCHED GAMES '''
+def _play_many_ab(backend, depth=2, seed=0):
+    ''' plays an alpha-beta player against a model from both sides with 
+        play_many and play_match, in a new interpreter using the given 
+        OTHELLO_BACKEND. Returns the results of play_many, after checking 
+        they are those of play_match '''
+    import os
+    import subprocess
+    code = (f"import numpy as np, play\n"
+            f"from research import Population\n"
+            f"agent = Population.random(1, np.random.default_rng({seed}))[0]\n"
+            f"model = play.ModelPlayer(agent, play.makemove, play.state2img, "
+            f"play.states2imgs)\n"
+            f"def ab():\n"
+            f"    return play.AlphaBetaPlayer(play.legalmoves, play.makemove,"
+            f" {depth}, **play.alphabeta_kwargs)\n"
+            f"many = play.play_many(ab(), model, 1) + "
+            f"play.play_many(model, ab(), 1)\n"
+            f"assert many == [ play.play_match(ab(), model), "
+            f"play.play_match(model, ab()) ], many\n"
+            f"print(many)")
+    env = dict(os.environ, OTHELLO_BACKEND=backend)
+    return subprocess.run([ sys.executable, '-c', code ], check=True,
+        capture_output=True, text=True, env=env).stdout.split('\n')[-2]
+
+def bench_play_many(n=1000, seed=0):
+    ''' checks that play_many gives the same results as play_matches, and as
+        play_match against an alpha-beta player with both engines, and 
+        compares the games/sec of play_match, play_matches and play_many, 
+        between two models and between two random players '''
+    import numpy as np
+    from research import Population, state2img, states2imgs
+    from players import ModelPlayer, RandomPlayer
+    from play import play_match, play_matches, play_many
+    population = Population.random(2, np.random.default_rng(seed))
+    p1, p2 = [ 
+        ModelPlayer(agent, makemove, state2img, states2imgs) 
+        for agent in population 
+    ]
+    assert play_many(p1, p2, 10, record=True) == \
+        play_matches([ (p1, p2) ] * 10, record=True)
+    # players without choosemoves get the boards of either engine
+    backend2results = { 
+        backend: _play_many_ab(backend) for backend in ('list', 'bitboard') 
+    }
+    print(f"alpha-beta vs model: {backend2results}")
+    assert len(set(backend2results.values())) == 1
+    rand_player = RandomPlayer()
+    print(f" players | driver       | games/sec")
+    for name, (b, w) in (('models', (p1, p2)), 
+                         ('random', (rand_player, rand_player))):
+        for driver, play_games, count in (
+                ('play_match', lambda n: [ play_match(b, w) 
+                    for _ in range(n) ], n // 10),
+                ('play_matches', lambda n: play_matches([ (b, w) ] * n), n),
+                ('play_many', lambda n: play_many(b, w, n), n)):
+            time_start = time.time()
+            play_games(count)
+            secs = time.time() - time_start
+            print(f" {name:<7} | {driver:<12} | {count/secs:>9.0f}")
+
+
+''' STARTUP '''
+def _import_time(statement):
+    ''' runs statement in a new interpreter, returning how long it took and 
+        whether TensorFlow got imported '''
+    import subprocess
+    code = (f"import sys, time\n"
+            f"time_start = time.time()\n"
+            f"{statement}\n"
+            f"print(time.time() - time_start, 'tensorflow' in sys.modules)")
+    output = subprocess.run([ sys.executable, '-c', code ], check=True,
+        capture_output=True, text=True).stdout.split()
+    return float(output[-2]), output[-1] == 'True'
+
+def bench_startup(max_secs=2.0):
+    ''' checks that the modules of the search-only tools import without
+        TensorFlow and quickly, and how long the lazily made players take the 
+        first time they are used '''
+    print(f" statement                         | secs   | tensorflow")
+    for statement, limited in (
+            ('import players', True),
+            ('import play', True), 
+            ('import play; play.ab3', False), 
+            ('import play; play.play2matches(play.ab3, play.rand_player)', 
+                False)):
+        secs, tensorflow = _import_time(statement)
+        print(f" {statement[:33]:<33} | {secs:>6.2f} | {tensorflow}")
+        assert not tensorflow, f"{statement} imported TensorFlow"
+        if limited:
+            assert secs < max_secs, f"{statement} took {secs:.2f} secs"
+
+BENCHMARKS = {
+    'engines': bench_engines,
+    'mpi': bench_mpi,
+    'ybw': bench_ybw,
+    'numpy_model': bench_numpy_model,
+    'eval_cache': bench_eval_cache,
+    'ga_operators': bench_ga_operators,
+    'ga_costs': bench_ga_costs,
+    'play_many': bench_play_many,
+    'startup': bench_startup,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"--- {name} ---")
+        BENCHMARKS[name]()
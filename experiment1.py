@@ -9,10 +9,12 @@ as well as average performance
 '''
 
 from libs.othellogame import *
+from libs.gamerecord import encode_moves
 from play import *
 
 def record_match(p1, p2):
-    '''plays a match between the two given models and returns the recording'''
+    '''plays a match between the two given models and returns the recording
+       (see libs/gamerecord)'''
     # setup game
     board = init_board()
     curr_turn = BLACK
@@ -20,101 +22,91 @@ def record_match(p1, p2):
     recording = []
     # start game
     while True:
-        moves = legalmoves(board, curr_turn)
-        if moves == []:
-            return recording, board.count(BLACK), board.count(WHITE)
+        move2flips = legalmoves_to_flips(board, curr_turn)
+        if not move2flips:
+            return encode_moves(recording), board.count(BLACK), \
+                board.count(WHITE)
+        moves = list(move2flips)
         # get the best move
         move = color2player[curr_turn].choosemove(board, moves, curr_turn)
         # make that move
-        makemove(board, move, curr_turn)
-        # add img to recording
-        recording.append(state2img(board, curr_turn))
+        makemove_with_flips(board, move, move2flips[move], curr_turn)
+        # add move to recording
+        recording.append(move)
         # pass turn
         curr_turn = -curr_turn
 
 from itertools import combinations
 from research import *
 from libs.util import *
+from scheduler import MatchScheduler
 
 def freeforall(population):
     '''plays a free-for-all tournament amongst all players'''
     agent2score = { agent: 0 for agent in population }
-    agent2imgs = { agent: [] for agent in population }
+    agent2games = { agent: [] for agent in population }
     img_sets = 0
     pop_size = len(population)
     cnt = freeforall_pop2cnt(pop_size)
     print(f"Starting freeforall with {pop_size} players ({cnt} matches)...")
     bar = ProgressBar(cnt)
-    agent2modelplayer = { 
-        agent: ModelPlayer(agent, makemove, state2img) 
-        for agent in population 
-    }
+    agent2index = { agent: i for i, agent in enumerate(population) }
+    # play match for each from both sides
+    matches = []
     for p1, p2 in combinations(population, 2):
-        # play match for each from both sides
-        p1m, p2m = agent2modelplayer[p1], agent2modelplayer[p2]
-        for bp, wp, bpm, wpm in [ [p1, p2, p1m, p2m], [p2, p1, p2m, p1m] ]:
-            # BLACK VS WHITE
-            recording, b_pieces, w_pieces = record_match(bpm, wpm)                
-            diff = b_pieces - w_pieces
-            agent2score[bp] += diff
-            agent2score[wp] -= diff
-            # now save states chosen by each agent
-            black_imgs = []
-            white_imgs = []
-            for i, img in enumerate(recording):
-                if i%2 == 0:
-                    black_imgs.append(img)
-                else:
-                    white_imgs.append(img)
-            agent2imgs[bp] += black_imgs
-            agent2imgs[wp] += white_imgs
-            img_sets += 1
-            # update progress
-            bar.update()
+        matches += [ [p1, p2], [p2, p1] ]
+    # all the matches are played over the worker processes
+    with MatchScheduler(serialize_pop(population)) as scheduler:
+        recordings = scheduler.play([
+            (agent2index[bp], agent2index[wp]) for bp, wp in matches
+        ], record=True, bar=bar)
+    for (bp, wp), (recording, b_pieces, w_pieces) in zip(matches, recordings):
+        # BLACK VS WHITE
+        diff = b_pieces - w_pieces
+        agent2score[bp] += diff
+        agent2score[wp] -= diff
+        # now save the game with the side each agent played
+        agent2games[bp].append((recording, BLACK))
+        agent2games[wp].append((recording, WHITE))
+        img_sets += 1
     info = {'img_sets': img_sets }
-    return agent2score, agent2imgs, info
+    return agent2score, agent2games, info
 
 
 def tournament(population):
     agent2score = { agent: 0 for agent in population }
-    agent2imgs = { agent: [] for agent in population }
+    agent2games = { agent: [] for agent in population }
     img_sets = 0
     hat = population.copy()
     cnt = tournament_pop2cnt(pop_size)
     print(f"Starting tournament with {pop_size} players ({cnt} matches)...")
     bar = ProgressBar(cnt)
-    agent2modelplayer = { 
-        agent: ModelPlayer(agent, makemove, state2img) 
-        for agent in population 
-    }
-    while len(hat) > 1:
-        for p1, p2 in zip(hat[::2], hat[1::2]):
-            p1m, p2m = agent2modelplayer[p1], agent2modelplayer[p2]
-            for bp, wp, bpm, wpm in [ [p1, p2, p1m, p2m], [p2, p1, p2m, p1m] ]:
+    agent2index = { agent: i for i, agent in enumerate(population) }
+    with MatchScheduler(serialize_pop(population)) as scheduler:
+        while len(hat) > 1:
+            matches = []
+            for p1, p2 in zip(hat[::2], hat[1::2]):
+                matches += [ [p1, p2], [p2, p1] ]
+            # the matches of a round are played over the worker processes
+            recordings = scheduler.play([
+                (agent2index[bp], agent2index[wp]) for bp, wp in matches
+            ], record=True, bar=bar)
+            for (bp, wp), (recording, b_pieces, w_pieces) in zip(matches, 
+                                                                 recordings):
                 # BLACK VS WHITE
-                recording, b_pieces, w_pieces = record_match(bpm, wpm)                
                 diff = b_pieces - w_pieces
                 agent2score[bp] += diff
                 agent2score[wp] -= diff
-                # now save states chosen by each agent
-                black_imgs = []
-                white_imgs = []
-                for i, img in enumerate(recording):
-                    if i%2 == 0:
-                        black_imgs.append(img)
-                    else:
-                        white_imgs.append(img)
-                agent2imgs[bp] += black_imgs
-                agent2imgs[wp] += white_imgs
+                # now save the game with the side each agent played
+                agent2games[bp].append((recording, BLACK))
+                agent2games[wp].append((recording, WHITE))
                 img_sets += 1
-                # update progress
-                bar.update()
-        # sort based on wins
-        ranked = sorted(agent2score, key=agent2score.get, reverse=True)
-        # hat becomes top half
-        hat = ranked[:len(hat)//2]
+            # sort based on wins
+            ranked = sorted(agent2score, key=agent2score.get, reverse=True)
+            # hat becomes top half
+            hat = ranked[:len(hat)//2]
     info = {'img_sets': img_sets }
-    return agent2score, agent2imgs, info
+    return agent2score, agent2games, info
 
 ''' CALCULATE DATA VS POPULATION RATIOS '''
 def freeforall_pop2cnt(pop_size):
@@ -150,29 +142,46 @@ def tournament_cnt2pop(count):
     return pop_size
 
 import math
+from libs.datastore import TrainingDataStore
+from libs.gamerecord import replay_positions
 ''' CREATE TRAINING DATA FROM ROUND '''
-def create_training_data(population, agent2score, agent2imgs):
+def write_training_data(store, population, agent2score, agent2games):
     """ From the return data tournament() or freeforall(), generate training
-        data such as train_images and train_labels """
-    # construct list of all imgs with parallel list of all labels
-    train_images = []
-    train_labels = []
-    pop_size = len(population)
+        data (the images of the states chosen by each agent labelled by its 
+        score), appending it to the given TrainingDataStore one agent at a 
+        time """
     for agent in population:
-        # add imgs to all images
+        # replay the games of the agent to get the states it chose
+        records = [ record for record, _ in agent2games[agent] ]
+        sides = [ side for _, side in agent2games[agent] ]
+        boards, players = replay_positions(records, sides)
+        # label all the imgs of the agent by its score
         val = math.tanh(agent2score[agent]/200) * 0.5 - 0.5
-        for img in agent2imgs[agent]:
-            train_images.append(img)
-            train_labels.append(val)
-    return train_images, train_labels
+        store.append(states2imgs(boards, players), val)
+    store.flush()
 
 import os
 def run_experiment(experiment_name, play_func, pop_size):
     exp_path = f'experiments/{experiment_name}'
     # define standard procedure to save a population
-    def save_population(population, generation_num):
-        pickle_dump(data=serialize_pop(population),
-            filename=f'{exp_path}/models/{generation_num:0>3}.pkl')
+    def save_population(population, generation_num, agent2score=None):
+        ''' saves a checkpoint of the population, with the scores of its
+            assessment if given. The scores must be of the weights being
+            saved, so a generation is saved without scores and saved again 
+            with them once it has been assessed. The checkpoint is written 
+            atomically and last, so it marks the generation as complete '''
+        checkpoint_population(f'{exp_path}/models/{generation_num:0>3}.ckpt',
+            population, generation_num, agent2score)
+    def latest_generation():
+        names = [ name for name in os.listdir(f'{exp_path}/models/')
+                  if name.endswith(('.ckpt', '.pkl')) ]
+        return int(max(names)[:3])
+    def load_generation(generation_num):
+        path = f'{exp_path}/models/{generation_num:0>3}'
+        if os.path.isfile(f'{path}.ckpt'):
+            return list(load_population(f'{path}.ckpt'))
+        # pickled populations of experiments started before checkpoints
+        return list(deserialize_pop(pickle_load(f'{path}.pkl')))
     # check if experiment already exists
     if not os.path.isdir(exp_path):
         # create relevant folders
@@ -183,8 +192,7 @@ def run_experiment(experiment_name, play_func, pop_size):
         # os.mkdir(f'{exp_path}/scores/')
         # create a population
         generation_num = 0
-        population = generate_population(pop_size)
-        save_population(population, generation_num)
+        population = list(generate_population(pop_size))
         # create performance CSV
         file = open(f'{exp_path}/misc/performance.csv', 'w')
         file.write(f'Generation\tab3\tab5\tab7\tr10\tn10\n')
@@ -194,24 +202,29 @@ def run_experiment(experiment_name, play_func, pop_size):
         file.write(f'Generation\t' + '\t'.join(map(str, range(pop_size))) + \
             '\n')
         file.close()
+        save_population(population, generation_num)
     else: # pick up where we left off
         # find out what the latest models set is
-        generation_num = int(max(os.listdir(f'{exp_path}/models/'))[:3])
+        generation_num = latest_generation()
         # load population
-        serialized_pop = pickle_load(
-            f'{exp_path}/models/{generation_num:0>3}.pkl')
-        population = deserialize_pop(serialized_pop)
+        population = load_generation(generation_num)
+        # drop the rows of a save phase that was killed before its checkpoint
+        drop_generations(f'{exp_path}/misc/performance.csv', generation_num)
+        drop_generations(f'{exp_path}/misc/data.csv', generation_num)
+
+    def training_data_path(generation_num):
+        return f'{exp_path}/training_data/{generation_num:0>3}'
 
     def assess(population):
         # get stats from playing match
-        agent2score, agent2imgs, info = play_func(population)
+        agent2score, agent2games, info = play_func(population)
         # get performance of best player
         top_model = max(agent2score, key=agent2score.get)
         performance = assess_top(top_model)
-        # build training images etc
-        train_images, train_labels = create_training_data(population, 
-            agent2score, agent2imgs)
-        return agent2score, performance, train_images, train_labels
+        # build training images etc, written to disk as they are made
+        store = TrainingDataStore(training_data_path(generation_num), 'w')
+        write_training_data(store, population, agent2score, agent2games)
+        return agent2score, performance, store
 
     def save_performance(performance):
         file = open(f'{exp_path}/misc/performance.csv', 'a')
@@ -225,10 +238,6 @@ def run_experiment(experiment_name, play_func, pop_size):
         file.write(f'{generation_num}\t' + '\t'.join(map(str, ranked)) + '\n')
         file.close()
 
-    def save_training_data(train_images, train_labels):
-        pickle_dump(data=[train_images, train_labels],
-            filename=f'{exp_path}/training_data/{generation_num:0>3}.pkl')
-
     tle = TimeLeftEstimator(generation_num, 100)
 
     # start the training
@@ -238,7 +247,10 @@ def run_experiment(experiment_name, play_func, pop_size):
         print(f"{now}: GENERATION {generation_num}")
 
         print(f"\n[1/3] ASSESSMENT [ SAFE TO KILL ]")
-        agent2score, performance, train_images, train_labels = assess(population)
+        agent2score, performance, store = assess(population)
+        # the scores are kept with the weights that earned them, before the
+        # agents are changed for the next generation
+        save_population(population, generation_num, agent2score)
 
         print(f"\n[2/3] TRAINING [ SAFE TO KILL ]")
         population = sorted(agent2score, key=agent2score.get, reverse=True)
@@ -246,16 +258,14 @@ def run_experiment(experiment_name, play_func, pop_size):
         print(f"top contributing 20%: {top_k}/{pop_size}")
         bar = ProgressBar(top_k)
         for agent in population[:top_k]:
-            agent.fit(train_images, train_labels, epochs=5, verbose=0)
+            agent.fit(store.dataset(), epochs=5, verbose=0)
             bar.update()
-        filler_pop = generate_population(pop_size - top_k)
-        for i in range(top_k, pop_size):
-            population[i] = filler_pop[i - top_k]
+        # the rest of the population is replaced by new agents
+        for agent in population[top_k:]:
+            agent.set_weights(random_weights())
 
-        print(f"\n[3/3] SAVE DATA [ NOT SAFE TO KILL ]")
-        bar = ProgressBar(4)
-        save_training_data(train_images, train_labels)
-        bar.update()
+        print(f"\n[3/3] SAVE DATA [ SAFE TO KILL ]")
+        bar = ProgressBar(3)
         save_performance(performance)
         bar.update()
         save_scores(agent2score)
@@ -1,8 +1,10 @@
 from research import *
 from libs.util import *
+from scheduler import MatchScheduler
 
 MUTATION_RATE = 0.8
 CULL_RATE = 0.2
+SEED = 2020
 # pop_size = 256
 # population = generate_population(pop_size)
 
@@ -19,57 +21,35 @@ def tournament(population):
     cnt = tournament_pop2cnt(pop_size)
     print(f"Starting tournament with {pop_size} players ({cnt} matches)...")
     bar = ProgressBar(cnt)
-    agent2modelplayer = { 
-        agent: ModelPlayer(agent, makemove, state2img) 
-        for agent in population 
-    }
-    while len(hat) > 1:
-        for p1, p2 in zip(hat[::2], hat[1::2]):
-            p1m, p2m = agent2modelplayer[p1], agent2modelplayer[p2]
-            for bp, wp, bpm, wpm in [ [p1, p2, p1m, p2m], [p2, p1, p2m, p1m] ]:
+    agent2index = { agent: i for i, agent in enumerate(population) }
+    with MatchScheduler(serialize_pop(population)) as scheduler:
+        while len(hat) > 1:
+            matches = []
+            for p1, p2 in zip(hat[::2], hat[1::2]):
+                matches += [ [p1, p2], [p2, p1] ]
+            # the matches of a round are played over the worker processes
+            results = scheduler.play([
+                (agent2index[bp], agent2index[wp]) for bp, wp in matches
+            ], bar=bar)
+            for (bp, wp), (b_pieces, w_pieces) in zip(matches, results):
                 # BLACK VS WHITE
-                b_pieces, w_pieces = play_match(bpm, wpm)                
                 diff = b_pieces - w_pieces
                 agent2score[bp] += diff
                 agent2score[wp] -= diff
-                # update progress
-                bar.update()
-        # sort based on wins
-        ranked = sorted(agent2score, key=agent2score.get, reverse=True)
-        # hat becomes top half
-        hat = ranked[:len(hat)//2]
+            # sort based on wins
+            ranked = sorted(agent2score, key=agent2score.get, reverse=True)
+            # hat becomes top half
+            hat = ranked[:len(hat)//2]
     return agent2score
 
-def randsample(n):
-    return random.sample(list(range(n)), random.randint(1, n-1))
-
-def mutate(model):
-    weights = model.get_weights()
-    layer1, _, layer2, _ = weights
-    for randint in randsample(128*16 + 16):
-        row = randint // 16
-        col = randint % 16
-        if row < 128:
-            layer1[row][col] = random.random() * 2 - 1
-        else:
-            layer2[col] = random.random() * 2 - 1
-    model.set_weights(weights)
-    return model
-
-
-def reproduce(mother, father):
-    child = generate_model()
-    child.set_weights(mother.get_weights())
-    c_weights = child.get_weights()
-    c_layer1, _, c_layer2, _ = c_weights
-    f_layer1, _, f_layer2, _ = father.get_weights()
-    for i in range(128):
-        for j in random.sample(range(16), random.randint(0, 15)):
-            c_layer1[i][j] = f_layer1[i][j]
-    for i in random.sample(range(16), random.randint(0, 15)):
-        c_layer2[i] = f_layer2[i]
-    child.set_weights(c_weights)
-    return child
+def mutate(weights, rng):
+    ''' mutates the weights of an agent, see research.mutate_weights '''
+    return mutate_weights(weights, rng)
+
+def reproduce(mother, father, rng):
+    ''' the weights of the child of the two given agents, see 
+        research.reproduce_weights '''
+    return reproduce_weights(mother.get_weights(), father.get_weights(), rng)
 
 from play import *
 
@@ -87,9 +67,25 @@ def run_experiment(experiment_name, pop_size):
         ranked = list(sorted(agent2score.values(), reverse=True))
         file.write(f'{generation_num}\t' + '\t'.join(map(str, ranked)) + '\n')
         file.close()
-    def save_population(population, generation_num):
-        pickle_dump(data=serialize_pop(population),
-            filename=f'{exp_path}/models/{generation_num:0>3}.pkl')
+    # define standard procedure to save a population
+    def save_population(population, generation_num, agent2score=None):
+        ''' saves a checkpoint of the population, with the scores of its
+            assessment if given. The scores must be of the weights being
+            saved, so a generation is saved without scores and saved again 
+            with them once it has been assessed. The checkpoint is written 
+            atomically and last, so it marks the generation as complete '''
+        checkpoint_population(f'{exp_path}/models/{generation_num:0>3}.ckpt',
+            population, generation_num, agent2score)
+    def latest_generation():
+        names = [ name for name in os.listdir(f'{exp_path}/models/')
+                  if name.endswith(('.ckpt', '.pkl')) ]
+        return int(max(names)[:3])
+    def load_generation(generation_num):
+        path = f'{exp_path}/models/{generation_num:0>3}'
+        if os.path.isfile(f'{path}.ckpt'):
+            return list(load_population(f'{path}.ckpt'))
+        # pickled populations of experiments started before checkpoints
+        return list(deserialize_pop(pickle_load(f'{path}.pkl')))
 
     def assess(population):
         agent2score = tournament(population)
@@ -107,8 +103,7 @@ def run_experiment(experiment_name, pop_size):
         # os.mkdir(f'{exp_path}/scores/')
         # create a population
         generation_num = 0
-        population = generate_population(pop_size)
-        save_population(population, generation_num)
+        population = list(generate_population(pop_size))
         # create performance CSV
         file = open(f'{exp_path}/misc/performance.csv', 'w')
         file.write(f'Generation\tab3\tab5\tab7\tr10\tn10\n')
@@ -118,13 +113,15 @@ def run_experiment(experiment_name, pop_size):
         file.write(f'Generation\t' + '\t'.join(map(str, range(pop_size))) + \
             '\n')
         file.close()
+        save_population(population, generation_num)
     else: # pick up where we left off
         # find out what the latest models set is
-        generation_num = int(max(os.listdir(f'{exp_path}/models/'))[:3])
+        generation_num = latest_generation()
         # load population
-        serialized_pop = pickle_load(
-            f'{exp_path}/models/{generation_num:0>3}.pkl')
-        population = deserialize_pop(serialized_pop)
+        population = load_generation(generation_num)
+        # drop the rows of a save phase that was killed before its checkpoint
+        drop_generations(f'{exp_path}/misc/performance.csv', generation_num + 1)
+        drop_generations(f'{exp_path}/misc/data.csv', generation_num + 1)
 
     tle = TimeLeftEstimator(generation_num, 200)
 
@@ -137,12 +134,16 @@ def run_experiment(experiment_name, pop_size):
 
         print(f"\n[1/3] ASSESSMENT [ SAFE TO KILL ]")
         agent2score, performance = assess(population)
+        # the scores are kept with the weights that earned them, before the
+        # agents are changed for the next generation
+        save_population(population, generation_num, agent2score)
 
 
         print(f"\n[2/3] REPRODUCTION [ SAFE TO KILL ]")
         population = sorted(agent2score, key=agent2score.get, reverse=True)
+        ordered_costs = [ agent2score[agent] for agent in population ]
         # calculate the top contributing members
-        top_k = calc_top_k(p=CULL_RATE)
+        top_k = calc_top_k(population, agent2score, p=CULL_RATE)
         # now we will use the top top_k
         fitness = ordered_costs[:top_k]
         mn = min(fitness)
@@ -157,28 +158,33 @@ def run_experiment(experiment_name, pop_size):
         for i in range(top_k):
             running_fitness += fitness[i]
             fitness[i] = running_fitness
-        # cull population
+        # cull population, keeping the models of the culled agents to hold
+        # the weights of the children
+        culled = population[top_k:]
         population = population[:top_k]
         top_agents = population.copy()
+        # seeded by generation, so a resumed experiment makes the same children
+        rng = np.random.default_rng([SEED, generation_num])
         def select_parent():
-            r = random.random()
+            r = rng.random()
             for i in range(top_k):
                 if r < fitness[i]:
                     return population[i]
         # fill up rest of population
-        for _ in range(top_k, pop_size):
+        for child in culled:
             # choose mother and father
             mother, father = select_parent(), select_parent()
             # create child
-            child = reproduce(mother, father)
+            weights = reproduce(mother, father, rng)
             # mutate with 80% probability
-            if random.random() < MUTATION_RATE:
-                child = mutate(child)
+            if rng.random() < MUTATION_RATE:
+                weights = mutate(weights, rng)
+            child.set_weights(weights)
             population.append(child)
         generation_num += 1
 
 
-        print(f"\n[3/3] SAVE DATA [ NOT SAFE TO KILL ]")
+        print(f"\n[3/3] SAVE DATA [ SAFE TO KILL ]")
         bar = ProgressBar(3)
         save_performance(performance)
         bar.update()
@@ -1,6 +1,73 @@
 import random
 import math
 
+def _batch_costs(cost, batch):
+    """ the costs of a batch of agents from a population cost function, as a
+        list in the order of the batch. When run by a process pool, the agents
+        in the dict returned by cost are copies of the ones in the population,
+        so the costs can only be matched back to them by position """
+    agent2cost = cost(batch)
+    return [ agent2cost[agent] for agent in batch ]
+
+def _costs(population, cost, population_cost=False, executor=None, 
+           batch_size=None, known=None):
+    """ the cost of every agent in the population, in the order of the 
+        population
+
+    Args:
+        population: list<Agent(Any)>
+            the agents whose cost is wanted
+        cost: 
+            see evolve
+        population_cost: bool
+            see evolve
+        executor: concurrent.futures.Executor
+            Optional; if given, then the costs are computed by its workers
+        batch_size: int
+            Optional; if given along with population_cost, then the population
+            is fed to cost in batches of this many agents, which are computed
+            at the same time if there is an executor
+        known: dict<Agent, float>
+            Optional; costs that are already known and are not computed again,
+            such as those of the agents that survived the previous generation.
+            Not used if population_cost is given without a batch_size, since
+            the cost of an agent may then depend on the rest of the population
+
+    Returns:
+        agent2cost: dict<Agent, float>
+    """
+    if population_cost and batch_size is None:
+        if executor is None:
+            return cost(population)
+        costs = executor.submit(_batch_costs, cost, population).result()
+        return dict(zip(population, costs))
+    if known is None:
+        known = {}
+    # each agent is only computed once, even if it is in the population twice
+    unknown = list(dict.fromkeys(
+        agent for agent in population if agent not in known))
+    if population_cost:
+        batches = [ unknown[i:i+batch_size] 
+                    for i in range(0, len(unknown), batch_size) ]
+        cost_fns = [ cost ] * len(batches)
+        if executor is None:
+            results = map(_batch_costs, cost_fns, batches)
+        else:
+            results = executor.map(_batch_costs, cost_fns, batches)
+        computed = {}
+        for batch, batch_costs in zip(batches, results):
+            computed.update(zip(batch, batch_costs))
+    else:
+        if executor is None:
+            results = map(cost, unknown)
+        else:
+            results = executor.map(cost, unknown)
+        computed = dict(zip(unknown, results))
+    return { 
+        agent: known[agent] if agent in known else computed[agent] 
+        for agent in population 
+    }
+
 def evolve_perfection(seed,
                       cost,
                       mutate,
@@ -9,7 +76,10 @@ def evolve_perfection(seed,
                       pop_size=10,
                       top_k=3,
                       max_repeat=100,
-                      max_iter=16):
+                      max_iter=16,
+                      executor=None,
+                      memoize=False,
+                      random_seed=None):
     """ Performs General Classical Genetic Algorithm, until either max_iter is
         reached, the lowest cost in the generation becomes 0 or the lowest cost
         has remained unchanged for 100 generations
@@ -39,6 +109,21 @@ def evolve_perfection(seed,
         max_iter: int
             the maximum number of iterations before the training is brought to
             a halt.
+        executor: concurrent.futures.Executor
+            Optional; if given, then the costs of the agents are computed at 
+            the same time by its workers (threads or processes). The costs are
+            always put together in the order of the population, so the results
+            do not depend on which worker finishes first
+        memoize: bool
+            Optional; if True, then the costs of the top_k agents that survive
+            into the next generation are not computed again. This requires 
+            that mutate and reproduce return new agents instead of changing 
+            the ones they are given and that cost is deterministic, otherwise
+            stale costs are reused. Defaults to False
+        random_seed: int
+            Optional; if given, then the parents and whether children are 
+            mutated are chosen by a random.Random(random_seed), so a run with 
+            deterministic cost, mutate and reproduce can be repeated
 
     Returns:
         agent2cost: dict<Agent, float>
@@ -46,6 +131,7 @@ def evolve_perfection(seed,
         iterations: int
             the nunber of iterations it took to complete the algorithm
     """
+    rng = random if random_seed is None else random.Random(random_seed)
     # create initial population
     population = [
         mutate(seed)
@@ -55,13 +141,15 @@ def evolve_perfection(seed,
     repeat = 0 # the amount of times all_time_best has remained unchanged
     top_k = max(top_k, 2)
     iterations = 0
+    agent2cost = {}
     # run simulation
     while True:
         # sort population by cost
-        agent2cost = { agent: cost(agent) for agent in population }
+        known = agent2cost if memoize else None
+        agent2cost = _costs(population, cost, executor=executor, known=known)
         population = sorted(agent2cost, key=agent2cost.get)
         
-        lowest_cost = population[0]
+        lowest_cost = agent2cost[population[0]]
 
         # check if lowest_cost has improved
         if lowest_cost < all_time_best:
@@ -81,11 +169,11 @@ def evolve_perfection(seed,
         # create the rest of the population from the top_k
         top_agents = population.copy()
         for _ in range(top_k, pop_size):
-            mother, father = random.sample(top_agents, 2)
+            mother, father = rng.sample(top_agents, 2)
             # create child
             child = reproduce(mother, father)
             # mutate with 80% probability
-            if random.random() < mutation_rate:
+            if rng.random() < mutation_rate:
                 child = mutate(child)
             population.append(child)
 
@@ -99,7 +187,11 @@ def evolve(population,
            population_cost=False,
            pop_size=None,
            top_k=3,
-           generations=16):
+           generations=16,
+           executor=None,
+           batch_size=None,
+           memoize=False,
+           random_seed=None):
     """ Performs General Classical Genetic Algorithm, evolving for a certain
         number of generations
 
@@ -144,29 +236,51 @@ def evolve(population,
         generations: int
             the number of iterations to evolve the given population before
             returning the new population
+        executor: concurrent.futures.Executor
+            Optional; if given, then the costs are computed at the same time 
+            by its workers (threads or processes). The costs are always put 
+            together in the order of the population, so the results do not 
+            depend on which worker finishes first
+        batch_size: int
+            Optional; only used with population_cost. If given, then cost is 
+            fed batches of this many agents instead of the whole population, 
+            which is only correct if the cost of an agent does not depend on 
+            the rest of the population
+        memoize: bool
+            Optional; if True, then the costs of the top_k agents that survive
+            into the next generation are not computed again. Not used with
+            population_cost unless batch_size is given. This requires that 
+            mutate and reproduce return new agents instead of changing the 
+            ones they are given and that cost is deterministic, otherwise 
+            stale costs are reused. Defaults to False
+        random_seed: int
+            Optional; if given, then the parents and whether children are 
+            mutated are chosen by a random.Random(random_seed), so a run with 
+            deterministic cost, mutate and reproduce can be repeated
 
     Returns:
         agent2cost: dict<Agent, float>
             mapping between each agent in the final population and their costs
     """
+    rng = random if random_seed is None else random.Random(random_seed)
     if pop_size == None:
         pop_size = len(population)
     else:
         while pop_size > len(population):
-            mutated = mutate(random.choice(population))
+            mutated = mutate(rng.choice(population))
             population.append(mutated)
         if pop_size < len(population):
             population = population[:pop_size]
     top_k = max(top_k, 2)
     generation = 0
+    agent2cost = {}
     # run simulation
     while True:
         print("generation =", generation)
         # sort population by cost
-        if population_cost:
-            agent2cost = cost(population)
-        else:
-            agent2cost = { agent: cost(agent) for agent in population }
+        known = agent2cost if memoize else None
+        agent2cost = _costs(population, cost, population_cost, executor, 
+            batch_size, known)
         population = sorted(agent2cost, key=agent2cost.get, reverse=reverse)
         # return if generation exceeds
         generation += 1
@@ -177,10 +291,10 @@ def evolve(population,
         # create the rest of the population from the top_k
         top_agents = population.copy()
         for _ in range(top_k, pop_size):
-            mother, father = random.sample(top_agents, 2)
+            mother, father = rng.sample(top_agents, 2)
             # create child
             child = reproduce(mother, father)
             # mutate with 80% probability
-            if random.random() < mutation_rate:
+            if rng.random() < mutation_rate:
                 child = mutate(child)
             population.append(child)
@@ -2,13 +2,163 @@ import math
 import time
 import random
 
+# types of bounds stored in the transposition table
+EXACT = 0
+LOWER = 1 # the value is at least the stored value (the node failed high)
+UPPER = 2 # the value is at most the stored value (the node failed low)
+
+class TranspositionTable(object):
+    """ Fixed size table of previously searched positions, indexed by their 
+        zobrist hash """
+    def __init__(self, size=2**16, replacement='depth'):
+        """ 
+        Args:
+            size: int
+                the number of entries in the table. Positions whose hashes 
+                collide on the same slot replace each other
+            replacement: str
+                'depth' to only replace an entry from the current search if the
+                new entry was searched at least as deep, or 'always' to always
+                replace the entry in the slot
+        """
+        if replacement not in ('depth', 'always'):
+            raise ValueError(f"Unknown replacement policy: {replacement}")
+        self.size = size
+        self.replacement = replacement
+        self.entries = [None] * size
+        self.age = 0
+        self.hits = 0
+        self.misses = 0
+        self.cutoffs = 0
+
+    def new_search(self):
+        """ marks entries stored so far as being from an older search, which 
+            makes them replaceable regardless of their depth """
+        self.age += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+
+    def probe(self, key: int):
+        """ gets the (key, depth, value, bound, move, age) entry stored for the 
+            given hash, or None if it is not in the table """
+        entry = self.entries[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key: int, depth: int, value, bound: int, move):
+        index = key % self.size
+        entry = self.entries[index]
+        if (entry is None or self.replacement == 'always' or entry[0] == key or
+                entry[5] != self.age or depth >= entry[1]):
+            self.entries[index] = (key, depth, value, bound, move, self.age)
+
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0
+
+
+# static value of each square of the 10x10 board layout for move ordering. 
+# corners are the best squares to take and the squares next to them the worst
+SQUARE_WEIGHTS = [
+    0,   0,   0,  0,  0,  0,  0,   0,   0, 0,
+    0, 100, -20, 10,  5,  5, 10, -20, 100, 0,
+    0, -20, -50, -2, -2, -2, -2, -50, -20, 0,
+    0,  10,  -2, -1, -1, -1, -1,  -2,  10, 0,
+    0,   5,  -2, -1, -1, -1, -1,  -2,   5, 0,
+    0,   5,  -2, -1, -1, -1, -1,  -2,   5, 0,
+    0,  10,  -2, -1, -1, -1, -1,  -2,  10, 0,
+    0, -20, -50, -2, -2, -2, -2, -50, -20, 0,
+    0, 100, -20, 10,  5,  5, 10, -20, 100, 0,
+    0,   0,   0,  0,  0,  0,  0,   0,   0, 0,
+]
+
+class MoveOrdering(object):
+    """ Orders the moves of a node so that the moves most likely to cause a 
+        cutoff are searched first """
+    def __init__(self, 
+                 killers=True, 
+                 history=True, 
+                 square_weights=SQUARE_WEIGHTS):
+        """
+        Args:
+            killers: bool
+                if True, then the last two moves that caused a cutoff at the 
+                same ply are tried first
+            history: bool
+                if True, then moves are ordered by how often (weighted by depth)
+                they caused cutoffs anywhere in the tree
+            square_weights: list
+                Optional; static value of each move, indexed by the move. Used 
+                to break ties. If None, then the static ordering is not used
+        """
+        self.use_killers = killers
+        self.use_history = history
+        self.square_weights = square_weights
+        self.killers = {} # ply -> [newest killer, older killer]
+        self.history = {} # (player, move) -> score
+
+    def new_search(self):
+        """ forgets the killers and ages the history of the previous search """
+        self.killers = {}
+        self.history = { 
+            k: score // 2 for k, score in self.history.items() if score > 1 
+        }
+
+    def order(self, moves: list, ply: int, curr_turn: any):
+        """ sorts the (move, flips) pairs from best to worst """
+        killers = self.killers.get(ply, ()) if self.use_killers else ()
+        def score(move_flips):
+            move = move_flips[0]
+            s = 0
+            if move in killers:
+                # killers come before every move without one
+                s += 1 << 40 if move == killers[0] else 1 << 39
+            if self.use_history:
+                s += self.history.get((curr_turn, move), 0) << 8
+            if self.square_weights is not None:
+                s += self.square_weights[move]
+            return s
+        return sorted(moves, key=score, reverse=True)
+
+    def cutoff(self, move: any, ply: int, curr_turn: any, depth: int):
+        """ records that move caused a cutoff at the given ply, searched with 
+            depth left """
+        if self.use_killers:
+            killers = self.killers.setdefault(ply, [])
+            if move not in killers:
+                killers.insert(0, move)
+                del killers[2:]
+        if self.use_history:
+            key = (curr_turn, move)
+            self.history[key] = self.history.get(key, 0) + depth * depth
+
+
+class OutOfTime(Exception):
+    """ Raised inside an iterative deepening search once the time limit has 
+        been exceeded, abandoning the unfinished iteration """
+    pass
+
+
 class AlphaBeta(object):
     """ Class used to get the best move looking at a given depth """
     def __init__(self,
                  legalmoves,
                  makemove,
                  evaluate,
-                 time_limit=5):
+                 time_limit=5,
+                 legalmoves_with_flips=None,
+                 makemove_with_flips=None,
+                 unmakemove=None,
+                 zobrist_hash=None,
+                 zobrist_update=None,
+                 tt_size=2**16,
+                 tt_replacement='depth',
+                 iterative=False,
+                 ordering=None):
         """ Initializes this class with the set values so that get_move() can be 
             called, giving only the curretn boardstate and the depth at which it 
             must be expored.
@@ -31,70 +181,410 @@ class AlphaBeta(object):
             time_limit: float
                 Optional; if given, then get_move will return back up the tree 
                 as soon as this time_limit has been exceeded.
+            legalmoves_with_flips: function(board, player)
+                Optional; function that returns a list of (move, flips) pairs.
+                If given together with makemove_with_flips, the search uses
+                these so that the flips of a move are only found once.
+            makemove_with_flips: function(board, move, flips, player)
+                Optional; function that performs a move using the flips from
+                legalmoves_with_flips.
+            unmakemove: function(board, undo)
+                Optional; if given, then makemove (or makemove_with_flips) 
+                must return an undo record which unmakemove uses to take the
+                move back. The whole search is then done in place on the 
+                given board instead of on a copy of the board per node.
+            zobrist_hash: function(board, player)
+                Optional; if given, then positions are hashed with this function
+                and stored in a transposition table so that positions reached 
+                through different move orders are not searched again.
+            zobrist_update: function(key, undo)
+                Optional; function that updates the hash using the undo record
+                returned by makemove, instead of hashing every child from 
+                scratch.
+            tt_size: int
+                the number of entries in the transposition table
+            tt_replacement: str
+                the replacement policy of the transposition table. See 
+                TranspositionTable
+            iterative: bool
+                Optional; if True, then get_move searches to depth 0, 1, 2... 
+                until max_depth is reached or the time_limit is spent and 
+                returns the best move of the deepest completed search. The 
+                principal variation of each search is tried first in the next.
+            ordering: MoveOrdering
+                Optional; if given, then the moves of each node are ordered by
+                it before the principal variation and transposition table moves
+                are moved to the front.
         """
         self.legalmoves = legalmoves
         self.makemove = makemove
         self.evaluate = evaluate
         self.time_limit = time_limit
+        self.legalmoves_with_flips = legalmoves_with_flips
+        self.makemove_with_flips = makemove_with_flips
+        self.use_flips = (legalmoves_with_flips is not None and
+                          makemove_with_flips is not None)
+        self.unmakemove = unmakemove
+        self.zobrist_hash = zobrist_hash
+        self.zobrist_update = zobrist_update
+        self.tt = None
+        self.tt_player = None
+        if zobrist_hash is not None:
+            self.tt = TranspositionTable(tt_size, tt_replacement)
+        self.iterative = iterative
+        self.pv = [] # principal variation of the last completed search
+        self.prev_pv = []
+        self.follow_pv = False
+        self.pv_table = []
+        self.root_depth = 0
+        self.depth_reached = None # depth of the last completed search
+        self.depth_log = [] # depth_reached for every call to get_move
+        self.ordering = ordering
+        self.nodes = 0 # nodes visited by the last call to get_move
+        self.nodes_log = [] # nodes for every call to get_move
     
     def get_move(self, board: list, player, opp, max_depth: int):
-        """ uses mini-max and alpha-beta pruning to get the best move """
+        """ uses mini-max and alpha-beta pruning to get the best move 
+        
+        When searching iteratively, max_depth may be None to keep deepening
+        until the time limit is spent.
+        """
+        if self.iterative:
+            return self._get_move_iterative(board, player, opp, max_depth)
         self.player = player
         self.opponent = lambda turn: opp if turn == player else player
         self.time_stop = time.time() + self.time_limit
-        moves = self.legalmoves(board, self.player)
+        self.root_depth = max_depth
+        self._new_search()
+        key = self._new_tt_search(board, player, player)
+        moves = self._moves(board, self.player)
         if moves == []:
             return -1
         max_move = -1
         max_v = -math.inf
-        for move in moves:
+        for move, flips in moves:
             if time.time() > self.time_stop:
                 print(f"OUT OF TIME")
                 if max_move == -1:
-                    return random.choice(moves)
+                    return random.choice(moves)[0]
                 return max_move
             # make the move on the board
-            alt = board.copy()
-            self.makemove(alt, move, self.player);
+            alt, undo = self._play(board, move, flips, self.player)
             # get the min value for the opponent
-            v = self._min_value(
-                alt, self.opponent(self.player), -math.inf, math.inf, max_depth)
+            next_turn = self.opponent(self.player)
+            v = self._min_value(alt, next_turn, -math.inf, math.inf, max_depth,
+                self._key(key, alt, undo, next_turn))
+            self._unplay(alt, undo)
             # get max count and max move
             if v > max_v:
                 max_v = v
                 max_move = move
+        self.depth_reached = max_depth
+        self.depth_log.append(max_depth)
+        self.nodes_log.append(self.nodes)
         return max_move
+
+    def get_value(self, 
+                  board: list, 
+                  player, 
+                  opp, 
+                  curr_turn, 
+                  depth: int, 
+                  alpha=-math.inf, 
+                  beta=math.inf, 
+                  time_stop=None):
+        """ searches the board with curr_turn to move and returns its value for
+            player. Used to search the subtrees of a root split, e.g. by 
+            AlphaBetaMPI. Always searches to a fixed depth.
+        
+        Args:
+            time_stop: float
+                Optional; the time.time() at which to stop searching. Defaults
+                to time_limit seconds from now
+        """
+        self.player = player
+        self.opponent = lambda turn: opp if turn == player else player
+        if time_stop is None:
+            time_stop = time.time() + self.time_limit
+        self.time_stop = time_stop
+        self.root_depth = depth
+        self._new_search()
+        key = self._new_tt_search(board, player, curr_turn)
+        iterative, self.iterative = self.iterative, False
+        try:
+            if curr_turn == player:
+                return self._max_value(board, curr_turn, alpha, beta, depth, 
+                    key)
+            return self._min_value(board, curr_turn, alpha, beta, depth, key)
+        finally:
+            self.iterative = iterative
+
+    def _get_move_iterative(self, board: list, player, opp, max_depth: int):
+        """ iterative deepening version of get_move() """
+        self.player = player
+        self.opponent = lambda turn: opp if turn == player else player
+        time_start = time.time()
+        self.time_stop = time_start + self.time_limit
+        self._new_search()
+        if self.unmakemove is not None:
+            # an abandoned search does not take its moves back
+            board = board.copy()
+        key = self._new_tt_search(board, player, player)
+        moves = self._moves(board, self.player)
+        if moves == []:
+            return -1
+        if max_depth is None:
+            max_depth = 60 # no game lasts longer than 60 moves
+        max_move = moves[0][0]
+        self.pv = []
+        self.depth_reached = None
+        for depth in range(max_depth + 1):
+            iteration_start = time.time()
+            try:
+                max_move, self.pv = self._search_root(board, moves, depth, key)
+            except OutOfTime:
+                break
+            self.depth_reached = depth
+            # do not start a search that is not expected to finish in time, 
+            # since each search takes longer than all of the previous ones
+            iteration_time = time.time() - iteration_start
+            if time.time() + iteration_time > self.time_stop:
+                break
+        self.depth_log.append(self.depth_reached)
+        self.nodes_log.append(self.nodes)
+        return max_move
+
+    def _search_root(self, board: list, moves: list, depth: int, key: any):
+        """ searches each of the moves to the given depth, trying the principal
+            variation of the previous search first 
+        
+        Returns:
+            (best move, principal variation)
+        """
+        self.prev_pv = self.pv
+        self.follow_pv = len(self.prev_pv) > 0
+        self.root_depth = depth
+        self.pv_table = [ [] for _ in range(depth + 2) ]
+        if self.ordering is not None:
+            moves = self.ordering.order(moves, 0, self.player)
+        if self.follow_pv:
+            moves = self._move_first(moves, self.prev_pv[0])
+        max_move = -1
+        max_v = -math.inf
+        alpha = -math.inf
+        for move, flips in moves:
+            alt, undo = self._play(board, move, flips, self.player)
+            next_turn = self.opponent(self.player)
+            v = self._min_value(alt, next_turn, alpha, math.inf, depth,
+                self._key(key, alt, undo, next_turn))
+            self._unplay(alt, undo)
+            self.follow_pv = False
+            if v > max_v:
+                max_v = v
+                max_move = move
+                self.pv_table[0] = [move] + self.pv_table[1]
+            if v > alpha:
+                alpha = v
+        return max_move, self.pv_table[0]
+
+    def _new_tt_search(self, board: list, player, curr_turn):
+        """ prepares the transposition table for a search by player and returns
+            the hash of the board with curr_turn to move (None without a 
+            transposition table) """
+        if self.tt is None:
+            return None
+        # values are stored from the perspective of self.player
+        if self.tt_player != player:
+            self.tt.clear()
+            self.tt_player = player
+        self.tt.new_search()
+        return self.zobrist_hash(board, curr_turn)
+
+    def _new_search(self):
+        self.nodes = 0
+        if self.ordering is not None:
+            self.ordering.new_search()
+
+    def effective_branching_factor(self):
+        """ the branching factor that a tree of the last search's depth would 
+            need to have as many nodes as were visited """
+        if self.depth_reached is None or self.nodes == 0:
+            return None
+        return self.nodes ** (1 / (self.depth_reached + 1))
+
+    def _out_of_time(self):
+        """ checks whether the time limit has been exceeded. An iterative search
+            is abandoned by raising OutOfTime """
+        if time.time() > self.time_stop:
+            if self.iterative:
+                raise OutOfTime()
+            return True
+        return False
+
+    def _ply(self, depth: int):
+        """ the distance from the root of a node searched with depth left """
+        return self.root_depth - depth + 1
+
+    def _update_pv(self, depth: int, move: any):
+        """ records move followed by the child's principal variation as the 
+            principal variation of the node """
+        if self.iterative:
+            ply = self._ply(depth)
+            self.pv_table[ply] = [move] + self.pv_table[ply+1]
+
+    def _clear_pv(self, depth: int):
+        if self.iterative:
+            self.pv_table[self._ply(depth)] = []
+
+    def _pv_move(self, depth: int):
+        """ gets the move of the previous principal variation at this node if 
+            the search is still following it """
+        if not self.follow_pv:
+            return None
+        ply = self._ply(depth)
+        if ply < len(self.prev_pv):
+            return self.prev_pv[ply]
+        self.follow_pv = False
+        return None
     
+    def _moves(self, board: any, curr_turn: any):
+        """ gets the (move, flips) pairs available to curr_turn. flips is None
+            when the flips are not precomputed """
+        if self.use_flips:
+            return self.legalmoves_with_flips(board, curr_turn)
+        return [ (move, None) for move in self.legalmoves(board, curr_turn) ]
+
+    def _play(self, board: any, move: any, flips: any, curr_turn: any):
+        """ makes the move and returns the (board, undo) pair. When searching 
+            in place the given board is changed, otherwise the move is made on 
+            a copy """
+        if self.unmakemove is None:
+            board = board.copy()
+        if self.use_flips:
+            undo = self.makemove_with_flips(board, move, flips, curr_turn)
+        else:
+            undo = self.makemove(board, move, curr_turn)
+        return board, undo
+
+    def _unplay(self, board: any, undo: any):
+        """ takes back a move made by _play() when searching in place """
+        if self.unmakemove is not None:
+            self.unmakemove(board, undo)
+
+    def _key(self, key: any, board: any, undo: any, curr_turn: any):
+        """ gets the hash of the board after the move described by undo, with 
+            curr_turn to move. None when no transposition table is used """
+        if self.tt is None:
+            return None
+        if self.zobrist_update is not None and undo is not None:
+            return self.zobrist_update(key, undo)
+        return self.zobrist_hash(board, curr_turn)
+
+    def _probe(self, key: any, depth: int, alpha: int, beta: int):
+        """ looks the position up in the transposition table. 
+        
+        Returns:
+            (value, alpha, beta, move) where value is not None if the stored 
+            entry is enough to return from the node straight away, alpha and 
+            beta are narrowed by the stored bound and move is the best move 
+            stored for this position
+        """
+        entry = self.tt.probe(key)
+        if entry is None:
+            return None, alpha, beta, None
+        _, entry_depth, value, bound, move, _ = entry
+        if entry_depth >= depth:
+            if bound == EXACT:
+                self.tt.cutoffs += 1
+                return value, alpha, beta, move
+            if bound == LOWER and value > alpha:
+                alpha = value
+            elif bound == UPPER and value < beta:
+                beta = value
+            if alpha >= beta:
+                self.tt.cutoffs += 1
+                return value, alpha, beta, move
+        return None, alpha, beta, move
+
+    def _store(self, key: any, depth: int, v: int, alpha: int, beta: int, move):
+        """ stores the value of a node that was searched with the (alpha, beta)
+            window """
+        # a node cut short by the time limit does not have a reliable value
+        if time.time() > self.time_stop:
+            return
+        if v <= alpha:
+            bound = UPPER
+        elif v >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, v, bound, move)
+
+    def _move_first(self, moves: list, first: any):
+        """ moves the (move, flips) pair of the given move to the front """
+        if first is None:
+            return moves
+        for i, (move, _) in enumerate(moves):
+            if move == first:
+                return [moves[i]] + moves[:i] + moves[i+1:]
+        return moves
+
+    def _order(self, moves: list, depth: int, tt_move: any, curr_turn: any):
+        """ orders the moves, trying the previous principal variation and then
+            the best move from the transposition table first """
+        if self.ordering is not None:
+            moves = self.ordering.order(moves, self._ply(depth), curr_turn)
+        moves = self._move_first(moves, tt_move)
+        return self._move_first(moves, self._pv_move(depth))
+
     def _max_value(self, 
                    board: any,
                    curr_turn: any, 
                    alpha: int, 
                    beta: int, 
-                   depth: int):
+                   depth: int,
+                   key: any = None):
         """ Implementation of max-value part of minimax pruning """
-        if depth <= 0 or time.time() > self.time_stop:
+        self.nodes += 1
+        self._clear_pv(depth)
+        if depth <= 0 or self._out_of_time():
             return self.evaluate(board, self.player)
+        tt_move = None
+        if self.tt is not None:
+            value, alpha, beta, tt_move = self._probe(key, depth, alpha, beta)
+            if value is not None:
+                return value
         # if no moves available, return current count
-        moves = self.legalmoves(board, curr_turn)
+        moves = self._moves(board, curr_turn)
         if moves == []:
             return self.evaluate(board, self.player)
-        # make a backup of the board
+        moves = self._order(moves, depth, tt_move, curr_turn)
+        alpha_orig = alpha
         v = -math.inf
-        for move in moves:
+        best_move = None
+        for move, flips in moves:
             # make the move on the board
-            alt = board.copy()
-            self.makemove(alt, move, curr_turn);
-            alt_v = self._min_value(
-                alt, self.opponent(curr_turn), alpha, beta, depth-1)
+            alt, undo = self._play(board, move, flips, curr_turn)
+            next_turn = self.opponent(curr_turn)
+            alt_v = self._min_value(alt, next_turn, alpha, beta, depth-1, 
+                self._key(key, alt, undo, next_turn))
+            self._unplay(alt, undo)
+            self.follow_pv = False
             # if alt v is better than current, set current since we are maximizing
             if alt_v > v:
                 v = alt_v
+                best_move = move
+                self._update_pv(depth, move)
             # if alt v is better than beta, we have nothing to explore. return curr v
             if alt_v >= beta:
-                return v
+                if self.ordering is not None:
+                    self.ordering.cutoff(move, self._ply(depth), curr_turn, depth)
+                break
             # if alt v is better than alpha, overwrite alpha
             if alt_v > alpha:
                 alpha = alt_v
+        if self.tt is not None:
+            self._store(key, depth, v, alpha_orig, beta, best_move)
         return v
 
     def _min_value(self,
@@ -102,30 +592,47 @@ class AlphaBeta(object):
                    curr_turn: any, 
                    alpha: int, 
                    beta: int, 
-                   depth: int):
+                   depth: int,
+                   key: any = None):
         """ Implementation of min-value part of minimax pruning """
-        if depth <= 0 or time.time() > self.time_stop:
+        self.nodes += 1
+        self._clear_pv(depth)
+        if depth <= 0 or self._out_of_time():
             return self.evaluate(board, self.player)
+        tt_move = None
+        if self.tt is not None:
+            value, alpha, beta, tt_move = self._probe(key, depth, alpha, beta)
+            if value is not None:
+                return value
         # if no moves available, return current count
-        moves = self.legalmoves(board, curr_turn)
+        moves = self._moves(board, curr_turn)
         if moves == []:
             return self.evaluate(board, self.player)
-        # make a backup of the board
-        backup = board.copy()
+        moves = self._order(moves, depth, tt_move, curr_turn)
+        beta_orig = beta
         v = math.inf
-        for move in moves:
+        best_move = None
+        for move, flips in moves:
             # make the move on the board
-            alt = board.copy()
-            self.makemove(board, move, curr_turn);
-            alt_v = self._max_value(
-                alt, self.opponent(curr_turn), alpha, beta, depth-1)
+            alt, undo = self._play(board, move, flips, curr_turn)
+            next_turn = self.opponent(curr_turn)
+            alt_v = self._max_value(alt, next_turn, alpha, beta, depth-1, 
+                self._key(key, alt, undo, next_turn))
+            self._unplay(alt, undo)
+            self.follow_pv = False
             # if alt v is worst than current, set current since we are minimizing
             if alt_v < v:
                 v = alt_v
+                best_move = move
+                self._update_pv(depth, move)
             # if alt v is worst than alpha, we have nothing to explore. return curr v
             if alt_v <= alpha:
-                return v
+                if self.ordering is not None:
+                    self.ordering.cutoff(move, self._ply(depth), curr_turn, depth)
+                break
             # if alt v is worst than beta, overwrite beta
             if alt_v < beta:
                 beta = alt_v
+        if self.tt is not None:
+            self._store(key, depth, v, alpha, beta_orig, best_move)
         return v
@@ -1,17 +1,63 @@
 import math
 import time
 import random
+import multiprocessing
 import concurrent.futures
 
+from libs.alphabeta import AlphaBeta
+
+def count_discs(board, player):
+    ''' the default evaluation: the number of discs player has on the board '''
+    return board.count(player)
+
+
+''' WORKER PROCESSES '''
+# set in each worker process by _init_worker
+_searcher = None
+_shared_alpha = None
+
+def _init_worker(legalmoves, makemove, evaluate, time_limit, alphabeta_kwargs,
+                 shared_alpha):
+    ''' creates the searcher of a worker process once, so that tasks only need
+        to send the board that must be searched '''
+    global _searcher, _shared_alpha
+    _searcher = AlphaBeta(legalmoves, makemove, evaluate, time_limit,
+        **alphabeta_kwargs)
+    _shared_alpha = shared_alpha
+
+def _search_root_child(alt, player, opp, depth, time_stop, alpha=None):
+    ''' searches the position after one of the root moves with the best value
+        found so far by any worker as alpha, or with the given alpha, in which
+        case the shared alpha is left as it is
+
+    Returns:
+        (value, alpha used, nodes searched). The value is only exact if it is
+        greater than the alpha used, otherwise it is an upper bound
+    '''
+    shared = alpha is None
+    if shared:
+        alpha = _shared_alpha.value
+    v = _searcher.get_value(alt, player, opp, opp, depth, alpha, math.inf,
+        time_stop)
+    if shared and v > alpha:
+        with _shared_alpha.get_lock():
+            if v > _shared_alpha.value:
+                _shared_alpha.value = v
+    return v, alpha, _searcher.nodes
+
+
 class AlphaBetaMPI(object):
-    """ Class used to get the best move looking at a given depth """
+    """ Class used to get the best move looking at a given depth, searching the
+        moves at the root in parallel """
     def __init__(self,
                  legalmoves,
                  makemove,
-                 evaluate,
-                 time_limit=5):
-        """ Initializes this class with the set values so that get_move() can be 
-            called, giving only the curretn boardstate and the depth at which it 
+                 evaluate=count_discs,
+                 time_limit=5,
+                 max_workers=None,
+                 **alphabeta_kwargs):
+        """ Initializes this class with the set values so that get_move() can be
+            called, giving only the curretn boardstate and the depth at which it
             must be expored.
 
         Args:
@@ -19,124 +65,108 @@ class AlphaBetaMPI(object):
                 Function that takes in a board and a player and spits out a list
                 of moves that can be fed to makemove() to perform a move
             makemove: function(board, move, player)
-                Function that performs a given move on the given board by the 
+                Function that performs a given move on the given board by the
                 given player.
-                The function must edit the given board to the new state after 
+                The function must edit the given board to the new state after
                 the move has been made
-            player: any
-                an object that is identified as the player who is trying to 
-                maximize its reward
-            opp: any
-                Like player, but is identified as the opponent of the player. 
-                This player will try to minimize our reward
+            evaluate: function(board, player)
+                Function that scores the board for the given player. Like
+                legalmoves and makemove it is sent to the worker processes, so
+                it must be defined at the top level of a module
             time_limit: float
-                Optional; if given, then get_move will return back up the tree 
+                Optional; if given, then get_move will return back up the tree
                 as soon as this time_limit has been exceeded.
+            max_workers: int
+                Optional; the number of worker processes. Defaults to the
+                number of processors
+            alphabeta_kwargs:
+                Optional arguments of the AlphaBeta used by each worker, such as
+                legalmoves_with_flips or zobrist_hash. The transposition table
+                of each worker is kept between moves.
         """
+        self.executor = None
+        if alphabeta_kwargs.get('iterative'):
+            raise ValueError("AlphaBetaMPI searches to a fixed depth")
         self.legalmoves = legalmoves
         self.makemove = makemove
-        # self.evaluate = evaluate
+        self.evaluate = evaluate
         self.time_limit = time_limit
-    
-    def evaluate(self, board, player):
-        return board.count(player)
-    
-    def opponent(self, turn):
-        return self.opp if turn == self.player else self.player
-    
+        self.max_workers = max_workers
+        self.alphabeta_kwargs = alphabeta_kwargs
+        self.shared_alpha = None
+        self.nodes = 0 # nodes visited by all workers in the last get_move
+        self.nodes_log = []
+
+    def _start_workers(self):
+        """ starts the worker processes the first time they are needed. The
+            same processes are used for every move until close() is called """
+        if self.executor is not None:
+            return
+        self.shared_alpha = multiprocessing.Value('d', -math.inf)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(self.legalmoves, self.makemove, self.evaluate,
+                      self.time_limit, self.alphabeta_kwargs,
+                      self.shared_alpha))
+
+    def close(self):
+        """ shuts the worker processes down """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+            self.shared_alpha = None
+
+    def __del__(self):
+        self.close()
+
     def get_move(self, board: list, player, opp, max_depth: int):
         """ uses mini-max and alpha-beta pruning to get the best move """
-        self.player = player
-        self.opp = opp
-        self.time_stop = time.time() + self.time_limit
-        moves = self.legalmoves(board, self.player)
+        self._start_workers()
+        time_stop = time.time() + self.time_limit
+        moves = self.legalmoves(board, player)
         if moves == []:
             return -1
-        max_move = -1
-        max_v = -math.inf
-        # apply multiprocessing to the problem
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            process2move = {}
-            for move in moves:
-                # make the move on the board
-                alt = board.copy()
-                self.makemove(alt, move, self.player);
-                # start the process
-                process = executor.submit(self._min_value,
-                    alt, self.opponent(self.player),
-                    -math.inf, math.inf, max_depth)
-                # add process to list
-                process2move[process] = move
-            for process in concurrent.futures.as_completed(process2move):
-                v = process.result()
-                move = process2move[process]
-                # get max count and max move
-                if v > max_v:
-                    max_v = v
-                    max_move = move
-        return max_move
-    
-    def _max_value(self, 
-                   board: any,
-                   curr_turn: any, 
-                   alpha: int, 
-                   beta: int, 
-                   depth: int):
-        """ Implementation of max-value part of minimax pruning """
-        if depth <= 0 or time.time() > self.time_stop:
-            return self.evaluate(board, self.player)
-        # if no moves available, return current count
-        moves = self.legalmoves(board, curr_turn)
-        if moves == []:
-            return self.evaluate(board, self.player)
-        # make a backup of the board
-        v = -math.inf
-        for move in moves:
-            # make the move on the board
-            alt = board.copy()
-            self.makemove(alt, move, curr_turn);
-            alt_v = self._min_value(
-                alt, self.opponent(curr_turn), alpha, beta, depth-1)
-            # if alt v is better than current, set current since we are maximizing
-            if alt_v > v:
-                v = alt_v
-            # if alt v is better than beta, we have nothing to explore. return curr v
-            if alt_v >= beta:
-                return v
-            # if alt v is better than alpha, overwrite alpha
-            if alt_v > alpha:
-                alpha = alt_v
-        return v
-
-    def _min_value(self,
-                   board: any,
-                   curr_turn: any, 
-                   alpha: int, 
-                   beta: int, 
-                   depth: int):
-        """ Implementation of min-value part of minimax pruning """
-        if depth <= 0 or time.time() > self.time_stop:
-            return self.evaluate(board, self.player)
-        # if no moves available, return current count
-        moves = self.legalmoves(board, curr_turn)
-        if moves == []:
-            return self.evaluate(board, self.player)
-        # make a backup of the board
-        backup = board.copy()
-        v = math.inf
+        # the best value found by any worker becomes the alpha of every root
+        # move searched after it
+        with self.shared_alpha.get_lock():
+            self.shared_alpha.value = -math.inf
+        move2alt = {}
+        move2process = {}
         for move in moves:
             # make the move on the board
             alt = board.copy()
-            self.makemove(board, move, curr_turn);
-            alt_v = self._max_value(
-                alt, self.opponent(curr_turn), alpha, beta, depth-1)
-            # if alt v is worst than current, set current since we are minimizing
-            if alt_v < v:
-                v = alt_v
-            # if alt v is worst than alpha, we have nothing to explore. return curr v
-            if alt_v <= alpha:
-                return v
-            # if alt v is worst than beta, overwrite beta
-            if alt_v < beta:
-                beta = alt_v
-        return v
+            self.makemove(alt, move, player)
+            move2alt[move] = alt
+            move2process[move] = self.executor.submit(_search_root_child,
+                alt, player, opp, max_depth, time_stop)
+        results = [ move2process[move].result() for move in moves ]
+        self.nodes = sum(nodes for _, _, nodes in results)
+        # a value that is not above the alpha it was searched with is only
+        # an upper bound, and some other move is at least as good
+        exact = [ v for v, alpha, _ in results if v > alpha ]
+        max_move = -1
+        max_v = max(exact) if exact else -math.inf
+        # ties are broken the same way as AlphaBeta: the first move, in their
+        # original order, whose value is the best value. A move searched
+        # after a later move raised alpha to the best value only has an upper
+        # bound equal to it, so it is searched again with an alpha just below
+        # the best value to find out whether it ties
+        tie_alpha = math.nextafter(max_v, -math.inf)
+        for move, (v, alpha, _) in zip(moves, results if exact else []):
+            if v > alpha:
+                if v == max_v:
+                    max_move = move
+                    break
+            elif v >= max_v:
+                v, _, nodes = self.executor.submit(_search_root_child,
+                    move2alt[move], player, opp, max_depth, time_stop,
+                    tie_alpha).result()
+                self.nodes += nodes
+                if v > tie_alpha:
+                    max_move = move
+                    break
+        self.nodes_log.append(self.nodes)
+        if max_move == -1:
+            return random.choice(moves)
+        return max_move
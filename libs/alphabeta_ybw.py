@@ -0,0 +1,219 @@
+import math
+import time
+import concurrent.futures
+
+from libs.alphabeta import AlphaBeta, SQUARE_WEIGHTS
+from libs.alphabeta_mpi import count_discs
+
+
+''' WORKER PROCESSES '''
+# set in each worker process by _init_worker
+_searcher = None
+
+def _init_worker(legalmoves, makemove, evaluate, time_limit, alphabeta_kwargs):
+    ''' creates the searcher of a worker process once '''
+    global _searcher
+    _searcher = AlphaBeta(legalmoves, makemove, evaluate, time_limit,
+        **alphabeta_kwargs)
+
+def _search_subtree(board, player, opp, curr_turn, alpha, beta, depth,
+                    time_stop):
+    ''' searches a whole subtree in the worker
+
+    Returns:
+        (value for player, nodes searched)
+    '''
+    v = _searcher.get_value(board, player, opp, curr_turn, depth, alpha, beta,
+        time_stop)
+    return v, _searcher.nodes
+
+
+class AlphaBetaYBW(object):
+    """ Class used to get the best move looking at a given depth using principal
+        variation search, splitting the search over worker processes with the
+        Young Brothers Wait concept.
+
+    At a node deep enough to split, the eldest brother (the first move) is
+    searched first. Once its value is known, the young brothers are searched in
+    parallel with null windows around that value and the ones that fail high are
+    searched again with a full window. The eldest brother is itself searched
+    the same way, so every node along the principal variation is split until the
+    remaining depth is below min_split_depth, where the subtree is searched by
+    a single AlphaBeta.
+
+    The null windows are one wide, so the evaluation must return integers.
+    """
+    def __init__(self,
+                 legalmoves,
+                 makemove,
+                 evaluate=count_discs,
+                 time_limit=5,
+                 max_workers=None,
+                 min_split_depth=3,
+                 **alphabeta_kwargs):
+        """
+        Args:
+            legalmoves: function(board, player)
+                Function that takes in a board and a player and spits out a list
+                of moves that can be fed to makemove() to perform a move
+            makemove: function(board, move, player)
+                Function that performs a given move on the given board by the
+                given player.
+            evaluate: function(board, player)
+                Function that scores the board for the given player. It is sent
+                to the worker processes, so it must be defined at the top level
+                of a module
+            time_limit: float
+                Optional; if given, then get_move will return back up the tree
+                as soon as this time_limit has been exceeded.
+            max_workers: int
+                Optional; the number of worker processes. Defaults to the
+                number of processors
+            min_split_depth: int
+                nodes with less depth left than this are not split, but searched
+                by a single process
+            alphabeta_kwargs:
+                Optional arguments of the AlphaBeta used by each process, such
+                as legalmoves_with_flips or zobrist_hash.
+        """
+        self.executor = None
+        if alphabeta_kwargs.get('iterative'):
+            raise ValueError("AlphaBetaYBW searches to a fixed depth")
+        self.legalmoves = legalmoves
+        self.makemove = makemove
+        self.evaluate = evaluate
+        self.time_limit = time_limit
+        self.max_workers = max_workers
+        self.min_split_depth = max(min_split_depth, 1)
+        self.alphabeta_kwargs = alphabeta_kwargs
+        # searches the subtrees that the master process does not hand out
+        self.local = AlphaBeta(legalmoves, makemove, evaluate, time_limit,
+            **alphabeta_kwargs)
+        self.nodes = 0 # nodes visited by all processes in the last get_move
+        self.nodes_log = []
+
+    def _start_workers(self):
+        """ starts the worker processes the first time they are needed """
+        if self.executor is not None:
+            return
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(self.legalmoves, self.makemove, self.evaluate,
+                      self.time_limit, self.alphabeta_kwargs))
+
+    def close(self):
+        """ shuts the worker processes down """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __del__(self):
+        self.close()
+
+    def get_move(self, board: list, player, opp, max_depth: int):
+        """ uses principal variation search to get the best move """
+        self._start_workers()
+        self.player = player
+        self.opp = opp
+        self.time_stop = time.time() + self.time_limit
+        self.nodes = 0
+        # the root has one more level than the depth given to its children
+        _, move = self._pvs(board, player, -math.inf, math.inf, max_depth+1)
+        self.nodes_log.append(self.nodes)
+        return move
+
+    def _opponent(self, turn):
+        return self.opp if turn == self.player else self.player
+
+    def _window(self, curr_turn, alpha, beta):
+        """ converts a window for curr_turn to a window for self.player """
+        if curr_turn == self.player:
+            return alpha, beta
+        return -beta, -alpha
+
+    def _value(self, curr_turn, v):
+        """ converts a value for self.player to a value for curr_turn, or
+            the other way around """
+        return v if curr_turn == self.player else -v
+
+    def _submit(self, board, curr_turn, alpha, beta, depth):
+        """ hands the search of a subtree to the worker processes. alpha and
+            beta are from the perspective of curr_turn """
+        root_alpha, root_beta = self._window(curr_turn, alpha, beta)
+        return self.executor.submit(_search_subtree, board, self.player,
+            self.opp, curr_turn, root_alpha, root_beta, depth, self.time_stop)
+
+    def _result(self, future, curr_turn):
+        v, nodes = future.result()
+        self.nodes += nodes
+        return self._value(curr_turn, v)
+
+    def _search_local(self, board, curr_turn, alpha, beta, depth):
+        """ searches a subtree in this process """
+        root_alpha, root_beta = self._window(curr_turn, alpha, beta)
+        v = self.local.get_value(board, self.player, self.opp, curr_turn,
+            depth, root_alpha, root_beta, self.time_stop)
+        self.nodes += self.local.nodes
+        return self._value(curr_turn, v)
+
+    def _pvs(self, board, curr_turn, alpha, beta, depth):
+        """ principal variation search of a node that may be split. Values are
+            from the perspective of curr_turn (negamax)
+
+        Returns:
+            (value, best move)
+        """
+        self.nodes += 1
+        if depth <= 0 or time.time() > self.time_stop:
+            return self._value(curr_turn,
+                self.evaluate(board, self.player)), None
+        moves = self.legalmoves(board, curr_turn)
+        if moves == []:
+            return self._value(curr_turn,
+                self.evaluate(board, self.player)), None
+        moves = sorted(moves, key=lambda move: -SQUARE_WEIGHTS[move])
+        next_turn = self._opponent(curr_turn)
+        children = []
+        for move in moves:
+            alt = board.copy()
+            self.makemove(alt, move, curr_turn)
+            children.append((move, alt))
+        # the eldest brother is searched first, splitting it further if deep
+        # enough
+        best_move, alt = children[0]
+        if depth - 1 >= self.min_split_depth:
+            v, _ = self._pvs(alt, next_turn, -beta, -alpha, depth-1)
+            best = -v
+        else:
+            best = -self._search_local(alt, next_turn, -beta, -alpha, depth-1)
+        if best >= beta:
+            return best, best_move
+        alpha = max(alpha, best)
+        # the young brothers are searched in parallel with null windows, which
+        # only tell whether they are better than the eldest brother
+        null_alpha = alpha
+        young = [
+            (move, alt, self._submit(alt, next_turn, -null_alpha-1,
+                -null_alpha, depth-1))
+            for move, alt in children[1:]
+        ]
+        for i, (move, alt, future) in enumerate(young):
+            v = -self._result(future, next_turn)
+            if v > null_alpha and v < beta:
+                # failed high: search again with the full window
+                if depth - 1 >= self.min_split_depth:
+                    v = -self._pvs(alt, next_turn, -beta, -alpha, depth-1)[0]
+                else:
+                    v = -self._search_local(alt, next_turn, -beta, -alpha,
+                        depth-1)
+            if v > best:
+                best = v
+                best_move = move
+            if v > alpha:
+                alpha = v
+            if alpha >= beta:
+                for _, _, later in young[i+1:]:
+                    later.cancel()
+                break
+        return best, best_move
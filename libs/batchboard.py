@@ -0,0 +1,160 @@
+''' Vectorized engine for many games at once.
+
+The boards of N games are held as two uint64 arrays, the black and the white
+discs of each game, with the bits laid out as in libs/bitboard. Legal moves,
+flips and disc counts are computed for all the games by numpy operations on
+the whole arrays, one direction at a time, instead of one board at a time.
+Moves are given as bit indices (0 - 63); BIT2SQ and SQ2BIT of libs/bitboard
+convert them to and from the 11 - 88 format.
+
+The games of a BoardBatch are played in lock step: the players always take
+turns, since a game ends as soon as the player to move has no legal moves, so
+the same player is to move in every game that is still being played.
+'''
+import numpy as np
+
+from libs.bitboard import BitBoard, BLACK, DIRECTIONS, BIT2SQ, init_board
+
+_ZERO = np.uint64(0)
+_ONE = np.uint64(1)
+# (bit shift, mask) of each direction as numpy scalars
+_DIRECTIONS = [ (d, np.uint64(mask)) for d, mask in DIRECTIONS ]
+# number of set bits of every byte
+_POPCOUNT8 = np.array([ bin(i).count('1') for i in range(256) ],
+    dtype=np.int8)
+BIT2SQ_ARRAY = np.array(BIT2SQ, dtype=np.uint8)
+
+def shift(x, d, mask):
+    ''' shifts every disc of every mask of x one step in the direction d '''
+    if d > 0:
+        return (x << np.uint64(d)) & mask
+    return (x >> np.uint64(-d)) & mask
+
+def moves_masks(own, opp):
+    ''' the masks of the squares own can legally move to, for every game '''
+    empty = ~(own | opp)
+    moves = np.zeros_like(own)
+    for d, mask in _DIRECTIONS:
+        x = shift(own, d, mask) & opp
+        # a line of opponent discs is at most 6 long
+        for _ in range(5):
+            x |= shift(x, d, mask) & opp
+        moves |= shift(x, d, mask) & empty
+    return moves
+
+def flips_masks(own, opp, move_bits):
+    ''' the masks of the opponent discs flipped by placing a disc on the
+        move_bits of every game '''
+    flips = np.zeros_like(own)
+    for d, mask in _DIRECTIONS:
+        line = np.zeros_like(own)
+        x = shift(move_bits, d, mask)
+        # follow the line of opponent discs, stopping on the first square
+        # that is not one
+        for _ in range(6):
+            on_line = (x & opp) != 0
+            line |= np.where(on_line, x, _ZERO)
+            x = np.where(on_line, shift(x, d, mask), x)
+        flips |= np.where((x & own) != 0, line, _ZERO)
+    return flips
+
+def popcounts(x):
+    ''' the number of set bits of every mask of x '''
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def unpack_bits(x):
+    ''' converts the masks of x into an (N, 64) uint8 array of their bits,
+        bit i in column i '''
+    x = np.ascontiguousarray(x, dtype='<u8')
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1,
+        bitorder='little')
+
+def random_bits(masks, rng):
+    ''' picks a random set bit of every (non empty) mask, returning the bit
+        indices '''
+    bits = unpack_bits(masks)
+    counts = bits.sum(axis=1)
+    nth = (rng.random(len(bits)) * counts).astype(np.int64)
+    return np.argmax(np.cumsum(bits, axis=1) > nth[:, None], axis=1)
+
+
+class BoardBatch(object):
+    ''' The boards of n games being played at the same time.
+
+    e.g.:
+    >>> games = BoardBatch(1000)
+    >>> while not games.done.all():
+    >>>     legal = games.legal_masks()
+    >>>     games.end(legal)
+    >>>     playing = np.flatnonzero(~games.done)
+    >>>     games.play(playing, random_bits(legal[playing], rng))
+    '''
+    def __init__(self, n):
+        start = init_board()
+        self.black = np.full(n, start.black, dtype=np.uint64)
+        self.white = np.full(n, start.white, dtype=np.uint64)
+        self.player = BLACK # the player to move
+        self.done = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.black)
+
+    def discs(self, games=slice(None)):
+        ''' the (own, opponent) masks of the given games from the perspective
+            of the player to move '''
+        if self.player == BLACK:
+            return self.black[games], self.white[games]
+        return self.white[games], self.black[games]
+
+    def legal_masks(self):
+        ''' the masks of the legal moves of the player to move, 0 in the games
+            that are over '''
+        legal = moves_masks(*self.discs())
+        legal[self.done] = 0
+        return legal
+
+    def end(self, legal):
+        ''' ends the games in which the player to move has no legal moves,
+            returning the indices of the games that just ended '''
+        ended = np.flatnonzero((legal == 0) & ~self.done)
+        self.done[ended] = True
+        return ended
+
+    def play(self, games, moves):
+        ''' makes a move, given as a bit index, in each of the given games and
+            passes the turn '''
+        own, opp = self.discs(games)
+        move_bits = _ONE << np.asarray(moves, dtype=np.uint64)
+        flips = flips_masks(own, opp, move_bits)
+        own = own | move_bits | flips
+        opp = opp ^ flips
+        if self.player == BLACK:
+            self.black[games], self.white[games] = own, opp
+        else:
+            self.white[games], self.black[games] = own, opp
+        self.player = -self.player
+
+    def counts(self):
+        ''' the (black, white) disc counts of every game '''
+        return popcounts(self.black), popcounts(self.white)
+
+    def board(self, game):
+        ''' the board of a game as a BitBoard '''
+        return BitBoard(int(self.black[game]), int(self.white[game]))
+
+
+def candidate_boards(own, opp, legal):
+    ''' the boards after every legal move of every game, from the perspective
+        of the player who moved
+
+    Returns:
+        (games, moves, own, opp) where games is the index of the game of each
+        candidate board, moves the bit index of its move and own, opp the
+        masks of the boards. Candidates are ordered by game, then by move
+    '''
+    games, moves = np.nonzero(unpack_bits(legal))
+    move_bits = _ONE << moves.astype(np.uint64)
+    own, opp = own[games], opp[games]
+    flips = flips_masks(own, opp, move_bits)
+    return games, moves, own | move_bits | flips, opp ^ flips
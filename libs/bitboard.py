@@ -0,0 +1,332 @@
+''' Bitboard implementation of the othello engine.
+
+The board is held as two 64-bit masks (one per colour) where bit
+(row-1)*8 + (col-1) represents the square row*10 + col of the padded 10x10
+list used by libs/othellogame. Moves are still given and returned in the
+11 - 88 format, so players written against the list engine work unchanged.
+'''
+import random
+
+BLACK = -1
+EMPTY = 0
+WHITE = 1
+OUTER = 3
+
+FULL = 0xFFFFFFFFFFFFFFFF
+NOT_A_FILE = 0xFEFEFEFEFEFEFEFE # every column except column 1
+NOT_H_FILE = 0x7F7F7F7F7F7F7F7F # every column except column 8
+
+# (bit shift, mask applied after the shift) for each of the 8 directions, in
+# the same order as ALLDIRECTIONS in libs/othellogame
+DIRECTIONS = [
+    (-9, NOT_H_FILE), # -11
+    (-8, FULL),       # -10
+    (-7, NOT_A_FILE), # -9
+    (-1, NOT_H_FILE), # -1
+    (1, NOT_A_FILE),  # 1
+    (7, NOT_H_FILE),  # 9
+    (8, FULL),        # 10
+    (9, NOT_A_FILE),  # 11
+]
+
+# conversions between squares in the 11 - 88 format and bit indices
+SQUARES = [ row*10 + col for row in range(1, 9) for col in range(1, 9) ]
+BIT2SQ = SQUARES
+SQ2BIT = { sq: 1 << i for i, sq in enumerate(SQUARES) }
+
+# zobrist keys, generated exactly as in libs/othellogame so that both engines
+# give the same hash for the same position
+ZOBRIST_SEED = 2020
+_zobrist_random = random.Random(ZOBRIST_SEED)
+ZOBRIST = { BLACK: [0] * 64, WHITE: [0] * 64 }
+for _bit in range(64):
+    ZOBRIST[BLACK][_bit] = _zobrist_random.getrandbits(64)
+    ZOBRIST[WHITE][_bit] = _zobrist_random.getrandbits(64)
+ZOBRIST_TURN = _zobrist_random.getrandbits(64) # xor-ed in when WHITE is to move
+
+def _byte_tables(keys):
+    ''' precomputes the xor of the keys of every combination of bits within each
+        of the 8 bytes of a mask, so a mask is hashed with 8 lookups '''
+    tables = []
+    for byte in range(8):
+        table = [0] * 256
+        for value in range(1, 256):
+            low = value & -value
+            table[value] = table[value ^ low] ^ keys[byte*8 + low.bit_length()-1]
+        tables.append(table)
+    return tables
+ZOBRIST_BYTES = { 
+    BLACK: _byte_tables(ZOBRIST[BLACK]), 
+    WHITE: _byte_tables(ZOBRIST[WHITE]),
+}
+
+
+class BitBoard(object):
+    ''' Othello board stored as a mask of black discs and a mask of white discs.
+
+    Indexing with a square of the padded 10x10 layout (board[44],
+    board[11:19]) as well as count() and copy() behave like the list board, so
+    code such as state2img and play_match can read it without changes.
+    '''
+    __slots__ = ['black', 'white']
+
+    def __init__(self, black=0, white=0):
+        self.black = black
+        self.white = white
+
+    def copy(self):
+        return BitBoard(self.black, self.white)
+
+    def count(self, piece):
+        if piece == BLACK:
+            return popcount(self.black)
+        if piece == WHITE:
+            return popcount(self.white)
+        if piece == EMPTY:
+            return 64 - popcount(self.black | self.white)
+        if piece == OUTER:
+            return 36
+        return 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ self[i] for i in range(*index.indices(100)) ]
+        bit = SQ2BIT.get(index)
+        if bit is None:
+            return OUTER
+        if self.black & bit:
+            return BLACK
+        if self.white & bit:
+            return WHITE
+        return EMPTY
+
+    def __len__(self):
+        return 100
+
+    def __iter__(self):
+        return (self[i] for i in range(100))
+
+    def __eq__(self, other):
+        if isinstance(other, BitBoard):
+            return self.black == other.black and self.white == other.white
+        return list(self) == list(other)
+
+    def __hash__(self):
+        return hash((self.black, self.white))
+
+    def __repr__(self):
+        return to_str(self)
+
+
+def popcount(x: int):
+    ''' counts the set bits in x '''
+    return bin(x).count('1')
+
+def discs(board: BitBoard, player: int):
+    ''' returns the (own, opponent) masks from the perspective of player '''
+    if player == BLACK:
+        return board.black, board.white
+    return board.white, board.black
+
+# opponent discs a line can run over when moving along a row or a diagonal:
+# a line that reaches column 1 or 8 cannot go on without wrapping around
+INNER_COLUMNS = 0x7E7E7E7E7E7E7E7E
+# (shift, mask of the opponent discs a line can run over) of each direction
+# pair, the direction shifting left and the opposite one shifting right
+LINE_SHIFTS = [ (1, INNER_COLUMNS), (8, FULL), (7, INNER_COLUMNS), 
+                (9, INNER_COLUMNS) ]
+
+def moves_mask(own: int, opp: int):
+    ''' returns the mask of all the squares own can legally move to. The
+        lines of opponent discs next to own are filled in every direction 
+        with the shifts written out, since this is the hot path of searches
+    '''
+    empty = ~(own | opp) & FULL
+    moves = 0
+    for s, mask in LINE_SHIFTS:
+        line = opp & mask
+        # a line of opponent discs is at most 6 long
+        x = line & (own << s)
+        x |= line & (x << s)
+        x |= line & (x << s)
+        x |= line & (x << s)
+        x |= line & (x << s)
+        x |= line & (x << s)
+        moves |= x << s
+        x = line & (own >> s)
+        x |= line & (x >> s)
+        x |= line & (x >> s)
+        x |= line & (x >> s)
+        x |= line & (x >> s)
+        x |= line & (x >> s)
+        moves |= x >> s
+    return moves & empty
+
+def flips_mask(own: int, opp: int, move_bit: int):
+    ''' returns the mask of opponent discs flipped by placing a disc on
+        move_bit '''
+    flips = 0
+    for s, mask in LINE_SHIFTS:
+        line = opp & mask
+        # follow the opponent discs next to the move, if there are any, and
+        # flip them if own closes the line
+        x = line & (move_bit << s)
+        if x:
+            y = line & (x << s)
+            while y:
+                x |= y
+                y = line & (y << s)
+            if (x << s) & own:
+                flips |= x
+        x = line & (move_bit >> s)
+        if x:
+            y = line & (x >> s)
+            while y:
+                x |= y
+                y = line & (y >> s)
+            if (x >> s) & own:
+                flips |= x
+    return flips
+
+def mask2squares(mask: int):
+    ''' converts a mask of bits to a list of squares in the 11 - 88 format '''
+    squares = []
+    while mask:
+        low = mask & -mask
+        squares.append(BIT2SQ[low.bit_length() - 1])
+        mask ^= low
+    return squares
+
+
+def init_board():
+    ''' initializes a starting board '''
+    return BitBoard(black=SQ2BIT[45] | SQ2BIT[54],
+                    white=SQ2BIT[44] | SQ2BIT[55])
+
+def legalmoves(board: BitBoard, player: int):
+    ''' gets a list of all of the legal moves for this player '''
+    own, opp = discs(board, player)
+    return mask2squares(moves_mask(own, opp))
+
+def legalmoves_with_flips(board: BitBoard, player: int):
+    ''' gets a list of (move, flips) pairs for all of the legal moves for this
+        player. Unlike the list engine, the flips are left as None: finding
+        them for every legal move costs more than it saves, since most moves 
+        of a search are pruned before they are made, so makemove_with_flips 
+        finds them once a move is actually made '''
+    own, opp = discs(board, player)
+    return [ (move, None) for move in mask2squares(moves_mask(own, opp)) ]
+
+def legalmoves_to_flips(board: BitBoard, player: int):
+    ''' gets a dict of each legal move for this player to None, the flips 
+        being found by makemove_with_flips() '''
+    return dict.fromkeys(legalmoves(board, player))
+
+# flips are only found for the moves that are made (see libs/othellogame)
+EAGER_FLIPS = False
+
+def makemove(board: BitBoard, move: int, player: int):
+    ''' makes the given move for the given player and returns the undo record
+        that unmakemove() can use to take the move back '''
+    bit = SQ2BIT[move]
+    if player == BLACK:
+        flips = flips_mask(board.black, board.white, bit)
+        board.black |= bit | flips
+        board.white ^= flips
+    else:
+        flips = flips_mask(board.white, board.black, bit)
+        board.white |= bit | flips
+        board.black ^= flips
+    return move, flips, player
+
+def makemove_with_flips(board: BitBoard, move: int, flips: int, player: int):
+    ''' makes the given move using the flips from legalmoves_with_flips(),
+        finding them first if they are None, and returns the undo record, 
+        which always holds the flips '''
+    bit = SQ2BIT[move]
+    if player == BLACK:
+        if flips is None:
+            flips = flips_mask(board.black, board.white, bit)
+        board.black |= bit | flips
+        board.white ^= flips
+    else:
+        if flips is None:
+            flips = flips_mask(board.white, board.black, bit)
+        board.white |= bit | flips
+        board.black ^= flips
+    return move, flips, player
+
+def unmakemove(board: BitBoard, undo: tuple):
+    ''' takes back the move described by the undo record from makemove() '''
+    move, flips, player = undo
+    if player == BLACK:
+        board.black ^= SQ2BIT[move] | flips
+        board.white |= flips
+    else:
+        board.white ^= SQ2BIT[move] | flips
+        board.black |= flips
+
+def _mask_key(mask: int, tables: list):
+    ''' xor of the zobrist keys of all the squares in mask '''
+    key = 0
+    for table in tables:
+        key ^= table[mask & 0xFF]
+        mask >>= 8
+    return key
+
+def zobrist_hash(board: BitBoard, player: int):
+    ''' gets the zobrist hash of the board with player being the one to move '''
+    key = ZOBRIST_TURN if player == WHITE else 0
+    return (key ^ _mask_key(board.black, ZOBRIST_BYTES[BLACK]) ^
+                  _mask_key(board.white, ZOBRIST_BYTES[WHITE]))
+
+def zobrist_update(key: int, undo: tuple):
+    ''' updates the zobrist hash after the move described by the undo record
+        from makemove(), after which the opponent is to move '''
+    move, flips, player = undo
+    key ^= ZOBRIST[player][SQ2BIT[move].bit_length()-1] ^ ZOBRIST_TURN
+    if flips:
+        key ^= (_mask_key(flips, ZOBRIST_BYTES[BLACK]) ^
+                _mask_key(flips, ZOBRIST_BYTES[WHITE]))
+    return key
+
+def get_winner(board: BitBoard):
+    ''' gets the winner of the match (the player with the mos discs. '''
+    whitepieces = board.count(WHITE)
+    blackpieces = board.count(BLACK)
+    if whitepieces > blackpieces:
+        return WHITE
+    elif whitepieces < blackpieces:
+        return BLACK
+    return EMPTY
+
+def _name_of(player):
+    return '.■□'[player]
+
+def to_str(board):
+    ''' converts the board to a string representation '''
+    s = '  ' + ' '.join(map(str, range(1, 9))) + '\n'
+    for row in range(1, 9):
+        s += f'{row} ' + ' '.join([
+            _name_of(board[col + 10*row])
+            for col in range(1, 9)
+        ]) + '\n'
+    return s
+
+
+''' CONVERSION TO AND FROM THE 10x10 LIST LAYOUT '''
+def from_list(board: list):
+    ''' converts a board in the padded 10x10 list layout to a BitBoard '''
+    black = white = 0
+    for sq, bit in SQ2BIT.items():
+        if board[sq] == BLACK:
+            black |= bit
+        elif board[sq] == WHITE:
+            white |= bit
+    return BitBoard(black, white)
+
+def to_list(board: BitBoard):
+    ''' converts a BitBoard to the padded 10x10 list layout used by
+        libs/othellogame '''
+    from libs.othellogame import BoardList
+    return BoardList(board[i] for i in range(100))
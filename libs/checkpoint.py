@@ -0,0 +1,125 @@
+''' Population checkpoints.
+
+A checkpoint holds the flattened weights of every agent of a population as
+one contiguous float32 array, preceded by a small JSON header:
+
+    magic b'OTHCKPT' + format version (1 byte)
+    length of the header (8 bytes, little endian)
+    header (JSON, padded with spaces so the weights are 64 byte aligned)
+    weights (pop_size, num_weights) float32, C order
+
+The header holds the generation number, the shapes of the weights of an agent
+and optionally the score of each agent. The weights can be memory-mapped, so
+single agents or the top k agents are loaded without reading the rest.
+Checkpoints are written to a temporary file that replaces the old one only
+once it is complete, so a crash never leaves a half written checkpoint.
+'''
+import os
+import json
+
+import numpy as np
+
+MAGIC = b'OTHCKPT'
+FORMAT_VERSION = 1
+_ALIGNMENT = 64
+
+def save_checkpoint(path, weights, generation, shapes, scores=None, **info):
+    """ writes a checkpoint atomically
+
+    Args:
+        path: str
+            the file to write
+        weights: numpy.ndarray
+            (pop_size, num_weights) array of the flattened weights of each
+            agent
+        generation: int
+            the generation number of the population
+        shapes: list<tuple>
+            the shapes of the weights of an agent, in the order they are
+            flattened in
+        scores: list<float>
+            Optional; the score of each agent, used by load_top_k
+        info:
+            Optional; anything else to keep in the header
+    """
+    weights = np.ascontiguousarray(weights, dtype=np.float32)
+    header = dict(info,
+        generation=int(generation),
+        pop_size=int(weights.shape[0]),
+        num_weights=int(weights.shape[1]),
+        dtype='float32',
+        shapes=[ list(shape) for shape in shapes ],
+        scores=None if scores is None else [ float(s) for s in scores ])
+    header = json.dumps(header).encode()
+    start = len(MAGIC) + 1 + 8 + len(header)
+    header += b' ' * (-start % _ALIGNMENT)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(MAGIC + bytes([FORMAT_VERSION]))
+        file.write(len(header).to_bytes(8, 'little'))
+        file.write(header)
+        file.write(weights.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+def _read_header(file):
+    magic = file.read(len(MAGIC) + 1)
+    if magic[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"Not a population checkpoint: {file.name}")
+    if magic[-1] != FORMAT_VERSION:
+        raise ValueError(f"Unknown checkpoint version: {magic[-1]}")
+    length = int.from_bytes(file.read(8), 'little')
+    header = json.loads(file.read(length))
+    header['offset'] = len(MAGIC) + 1 + 8 + length
+    return header
+
+def read_header(path):
+    """ the header of a checkpoint, plus the offset of the weights """
+    with open(path, 'rb') as file:
+        return _read_header(file)
+
+def load_checkpoint(path, indices=None, mmap=True):
+    """ loads the weights of a checkpoint
+
+    Args:
+        path: str
+            the checkpoint
+        indices: list<int>
+            Optional; if given, then only the weights of these agents are
+            loaded, in the given order
+        mmap: bool
+            Optional; if True, then the weights are memory-mapped and only the
+            rows that are used are read. Defaults to True
+
+    Returns:
+        (weights, header). weights is a (pop_size, num_weights) array, or
+        (len(indices), num_weights) if indices are given
+    """
+    header = read_header(path)
+    shape = (header['pop_size'], header['num_weights'])
+    if mmap:
+        weights = np.memmap(path, dtype=np.float32, mode='r',
+            offset=header['offset'], shape=shape)
+    else:
+        with open(path, 'rb') as file:
+            file.seek(header['offset'])
+            weights = np.fromfile(file, dtype=np.float32,
+                count=shape[0]*shape[1]).reshape(shape)
+    if indices is not None:
+        return np.array(weights[np.asarray(indices, dtype=np.intp)]), header
+    return np.array(weights), header
+
+def load_top_k(path, k):
+    """ loads the k agents of the checkpoint with the highest scores, best
+        first """
+    header = read_header(path)
+    if header['scores'] is None:
+        raise ValueError(f"The checkpoint has no scores: {path}")
+    order = np.argsort(-np.asarray(header['scores']), kind='stable')[:k]
+    return load_checkpoint(path, order)
+
+def load_agent(path, index):
+    """ loads the weights of a single agent as a (num_weights,) array """
+    weights, header = load_checkpoint(path, [ index ])
+    return weights[0], header
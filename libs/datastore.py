@@ -0,0 +1,185 @@
+''' Append-only store of training data.
+
+Images (see research.state2img) are packed to 2 bits per square, i.e. 16
+bytes per image, and kept with their float32 labels in shards of .npy files:
+
+    <path>/index.json
+    <path>/00000_images.npy   uint8 (n, 16)
+    <path>/00000_labels.npy   float32 (n,)
+    ...
+
+Shards are written as soon as shard_size images have been appended, and the
+index is only updated once a shard is complete, so a store that was
+interrupted can still be read up to its last complete shard. Shards are read
+memory-mapped one at a time, so the data never has to fit in memory.
+'''
+import os
+import json
+
+import numpy as np
+
+# 2 bit code of every square: 0 empty, 1 the player's own, 2 the opponent's
+_CODE_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+
+def pack_imgs(imgs):
+    ''' packs an (N, 64, 2) array of images into an (N, 16) uint8 array '''
+    imgs = np.asarray(imgs)
+    codes = (imgs[:, :, 0] > 0.5).astype(np.uint8)
+    codes |= (imgs[:, :, 1] > 0.5).astype(np.uint8) << 1
+    codes = codes.reshape(len(imgs), 16, 4) << _CODE_SHIFTS
+    return np.bitwise_or.reduce(codes, axis=2)
+
+def unpack_imgs(packed, dtype=np.float32):
+    ''' unpacks the (N, 16) output of pack_imgs into (N, 64, 2) images '''
+    packed = np.asarray(packed, dtype=np.uint8)
+    codes = (packed[:, :, None] >> _CODE_SHIFTS) & 3
+    codes = codes.reshape(len(packed), 64)
+    return np.stack([ codes == 1, codes == 2 ], axis=2).astype(dtype)
+
+
+class TrainingDataStore(object):
+    """ Chunked store of (image, label) pairs on disk.
+
+    e.g.:
+    >>> store = TrainingDataStore('training_data/000', mode='w')
+    >>> store.append(imgs, labels)
+    >>> store.close()
+    >>> agent.fit(TrainingDataStore('training_data/000').dataset(), epochs=5)
+    """
+    def __init__(self, path, mode='r', shard_size=2**16):
+        """
+        Args:
+            path: str
+                the directory of the store
+            mode: str
+                'r' to read an existing store, 'a' to append to a store
+                (creating it if needed) or 'w' to start a new store, removing
+                the shards of any store that was there
+            shard_size: int
+                the number of images per shard when writing
+        """
+        self.path = path
+        self.mode = mode
+        self.shard_size = shard_size
+        self._images = []
+        self._labels = []
+        self._buffered = 0
+        if mode == 'r':
+            self.shards = self._read_index()
+            return
+        if mode not in ('a', 'w'):
+            raise ValueError(f"Unknown mode: {mode}")
+        os.makedirs(path, exist_ok=True)
+        if mode == 'w':
+            for name in os.listdir(path):
+                if name.endswith('.npy') or name == 'index.json':
+                    os.remove(os.path.join(path, name))
+            self.shards = []
+            self._write_index()
+        else:
+            self.shards = self._read_index() if os.path.isfile(
+                self._index_path()) else []
+
+    def __len__(self):
+        return sum(shard['count'] for shard in self.shards) + self._buffered
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _index_path(self):
+        return os.path.join(self.path, 'index.json')
+
+    def _read_index(self):
+        with open(self._index_path()) as file:
+            return json.load(file)['shards']
+
+    def _write_index(self):
+        # written to a temporary file first, so the index is never half done
+        tmp_path = self._index_path() + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({ 'shards': self.shards }, file)
+        os.replace(tmp_path, self._index_path())
+
+    def append(self, imgs, labels):
+        """ adds images and their labels, writing out every full shard """
+        if self.mode == 'r':
+            raise ValueError("The store was opened for reading")
+        imgs = np.asarray(imgs)
+        if len(imgs) == 0:
+            return
+        self._images.append(pack_imgs(imgs))
+        self._labels.append(np.broadcast_to(
+            np.asarray(labels, dtype=np.float32), (len(imgs),)))
+        self._buffered += len(imgs)
+        while self._buffered >= self.shard_size:
+            self._write_shard(self.shard_size)
+
+    def flush(self):
+        """ writes out the images that do not fill a whole shard yet """
+        if self._buffered:
+            self._write_shard(self._buffered)
+
+    def close(self):
+        if self.mode != 'r':
+            self.flush()
+
+    def _write_shard(self, count):
+        images = np.concatenate(self._images)
+        labels = np.concatenate(self._labels)
+        name = f'{len(self.shards):0>5}'
+        np.save(os.path.join(self.path, f'{name}_images.npy'), images[:count])
+        np.save(os.path.join(self.path, f'{name}_labels.npy'), labels[:count])
+        self.shards.append({ 'name': name, 'count': int(count) })
+        self._write_index()
+        self._images = [ images[count:] ]
+        self._labels = [ labels[count:] ]
+        self._buffered -= count
+
+    def read_shard(self, i, mmap_mode='r'):
+        """ the packed images and the labels of the i-th shard """
+        name = self.shards[i]['name']
+        images = np.load(os.path.join(self.path, f'{name}_images.npy'),
+            mmap_mode=mmap_mode)
+        labels = np.load(os.path.join(self.path, f'{name}_labels.npy'),
+            mmap_mode=mmap_mode)
+        return images, labels
+
+    def batches(self, batch_size=32, shuffle=False, rng=None):
+        """ generates (images, labels) batches, reading one shard at a time.
+            If shuffle is True, then the order of the shards and of the
+            images within each shard is shuffled """
+        if shuffle and rng is None:
+            rng = np.random.default_rng()
+        order = np.arange(len(self.shards))
+        if shuffle:
+            rng.shuffle(order)
+        for i in order:
+            images, labels = self.read_shard(i)
+            indices = np.arange(len(labels))
+            if shuffle:
+                rng.shuffle(indices)
+            for start in range(0, len(indices), batch_size):
+                batch = np.sort(indices[start:start+batch_size])
+                yield unpack_imgs(images[batch]), np.array(labels[batch])
+
+    def load(self):
+        """ all the images and labels in memory """
+        if not self.shards:
+            return np.zeros((0, 64, 2), np.float32), np.zeros(0, np.float32)
+        shards = [ self.read_shard(i) for i in range(len(self.shards)) ]
+        return (unpack_imgs(np.concatenate([ images for images, _ in shards ])),
+                np.concatenate([ labels for _, labels in shards ]))
+
+    def dataset(self, batch_size=32, shuffle=True):
+        """ the store as a tf.data.Dataset of batches, which keras.Model.fit
+            iterates again every epoch """
+        import tensorflow as tf
+        return tf.data.Dataset.from_generator(
+            lambda: self.batches(batch_size, shuffle),
+            output_signature=(
+                tf.TensorSpec(shape=(None, 64, 2), dtype=tf.float32),
+                tf.TensorSpec(shape=(None,), dtype=tf.float32),
+            ))
@@ -0,0 +1,179 @@
+''' Exact endgame solver.
+
+Searches the rest of the game to its end and returns the exact disc
+differential of the best move. The rules are the ones of play_match: the game
+ends as soon as the player to move has no legal moves. The search works on
+bitboards (see libs/bitboard) whichever engine the board comes from.
+'''
+import math
+
+from libs.bitboard import (BitBoard, BLACK, FULL, BIT2SQ, popcount, moves_mask,
+    flips_mask, from_list)
+
+# the 4 quadrants of the board, used for parity ordering
+QUADRANTS = [
+    0x000000000F0F0F0F, # rows 1-4, columns 1-4
+    0x00000000F0F0F0F0, # rows 1-4, columns 5-8
+    0x0F0F0F0F00000000, # rows 5-8, columns 1-4
+    0xF0F0F0F000000000, # rows 5-8, columns 5-8
+]
+
+class EndgameSolver(object):
+    """ Solves positions with few empty squares exactly """
+    def __init__(self, fastest_first_empties=7):
+        """
+        Args:
+            fastest_first_empties: int
+                with at least this many empties left, moves are ordered by the
+                number of replies they leave the opponent (fewest first). With
+                fewer empties only the cheaper parity ordering is used
+        """
+        self.fastest_first_empties = fastest_first_empties
+        self.nodes = 0 # nodes visited by the last call to solve
+
+    def solve(self, board, player):
+        """ finds the best move for player and the disc differential (player's
+            discs minus the opponent's) at the end of the game if both sides
+            play perfectly
+
+        Returns:
+            (best move, disc differential). The move is -1 if player has no
+            legal moves, in which case the game is already over
+        """
+        if not isinstance(board, BitBoard):
+            board = from_list(board)
+        if player == BLACK:
+            own, opp = board.black, board.white
+        else:
+            own, opp = board.white, board.black
+        self.nodes = 0
+        empties = self._ordered_empties(own, opp)
+        best_move = -1
+        best = -math.inf
+        alpha, beta = -64, 64
+        for bit in self._ordered_moves(own, opp, empties):
+            flips = flips_mask(own, opp, bit)
+            v = -self._solve(opp ^ flips, own | bit | flips, -beta, -alpha)
+            if v > best:
+                best = v
+                best_move = BIT2SQ[bit.bit_length() - 1]
+            if v > alpha:
+                alpha = v
+        if best_move == -1:
+            return -1, popcount(own) - popcount(opp)
+        return best_move, best
+
+    def _ordered_empties(self, own, opp):
+        """ lists the empty squares, those in quadrants with an odd number of
+            empties first. The last move into a region is usually the player
+            who gets to keep its discs """
+        empty = ~(own | opp) & FULL
+        odd_quadrants = 0
+        for quadrant in QUADRANTS:
+            if popcount(empty & quadrant) % 2:
+                odd_quadrants |= quadrant
+        odd = []
+        even = []
+        while empty:
+            bit = empty & -empty
+            empty ^= bit
+            if bit & odd_quadrants:
+                odd.append(bit)
+            else:
+                even.append(bit)
+        return odd + even
+
+    def _ordered_moves(self, own, opp, empties):
+        """ the legal moves among the empties, ordered fastest first when
+            there are enough empties left to make it worth it """
+        moves = []
+        for bit in empties:
+            flips = flips_mask(own, opp, bit)
+            if flips:
+                moves.append((bit, flips))
+        if len(empties) >= self.fastest_first_empties:
+            def mobility(move):
+                bit, flips = move
+                return popcount(moves_mask(opp ^ flips, own | bit | flips))
+            moves.sort(key=mobility)
+        return [ bit for bit, _ in moves ]
+
+    def _solve(self, own, opp, alpha, beta):
+        """ negamax value of the position with own to move """
+        empties = self._ordered_empties(own, opp)
+        n = len(empties)
+        if n == 3:
+            return self._solve3(own, opp, alpha, beta, *empties)
+        if n == 2:
+            return self._solve2(own, opp, alpha, beta, *empties)
+        if n == 1:
+            return self._solve1(own, opp, empties[0])
+        self.nodes += 1
+        if n == 0:
+            return popcount(own) - popcount(opp)
+        best = -math.inf
+        if n >= self.fastest_first_empties:
+            moves = self._ordered_moves(own, opp, empties)
+        else:
+            moves = empties
+        for bit in moves:
+            flips = flips_mask(own, opp, bit)
+            if not flips:
+                continue
+            v = -self._solve(opp ^ flips, own | bit | flips, -beta, -alpha)
+            if v > best:
+                best = v
+                if v > alpha:
+                    alpha = v
+                    if alpha >= beta:
+                        return best
+        if best == -math.inf:
+            # no legal moves, the game is over
+            return popcount(own) - popcount(opp)
+        return best
+
+    def _solve3(self, own, opp, alpha, beta, e1, e2, e3):
+        """ value with exactly 3 empties left """
+        self.nodes += 1
+        best = -math.inf
+        for bit, rest1, rest2 in ((e1, e2, e3), (e2, e1, e3), (e3, e1, e2)):
+            flips = flips_mask(own, opp, bit)
+            if flips:
+                v = -self._solve2(opp ^ flips, own | bit | flips, -beta,
+                    -alpha, rest1, rest2)
+                if v > best:
+                    best = v
+                    if v > alpha:
+                        alpha = v
+                        if alpha >= beta:
+                            return best
+        if best == -math.inf:
+            return popcount(own) - popcount(opp)
+        return best
+
+    def _solve2(self, own, opp, alpha, beta, e1, e2):
+        """ value with exactly 2 empties left """
+        self.nodes += 1
+        best = -math.inf
+        flips = flips_mask(own, opp, e1)
+        if flips:
+            best = -self._solve1(opp ^ flips, own | e1 | flips, e2)
+            if best >= beta:
+                return best
+        flips = flips_mask(own, opp, e2)
+        if flips:
+            v = -self._solve1(opp ^ flips, own | e2 | flips, e1)
+            if v > best:
+                best = v
+        if best == -math.inf:
+            return popcount(own) - popcount(opp)
+        return best
+
+    def _solve1(self, own, opp, e1):
+        """ value with exactly 1 empty left """
+        self.nodes += 1
+        flips = flips_mask(own, opp, e1)
+        if flips:
+            # the board is full after this move
+            return popcount(own | e1 | flips) - popcount(opp ^ flips)
+        return popcount(own) - popcount(opp)
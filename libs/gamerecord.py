@@ -0,0 +1,53 @@
+''' Compact records of played games.
+
+A game is recorded as the bytes of its moves, one byte per move (squares are
+in the 11 - 88 format, so they fit as they are). The players always take
+turns, since a game ends as soon as the player to move has no legal moves, so
+black made the moves at even indices and white the ones at odd indices. The
+boards of a game are only made again when they are needed, by replaying it.
+'''
+from libs.othellogame import BLACK, WHITE, init_board, makemove
+
+def encode_moves(moves):
+    ''' the record of the given list of moves '''
+    return bytes(moves)
+
+def mover(ply):
+    ''' the player who made the move at index ply of a record '''
+    return BLACK if ply % 2 == 0 else WHITE
+
+def replay(record):
+    ''' the boards after every move of the record '''
+    board = init_board()
+    boards = []
+    for ply, move in enumerate(record):
+        makemove(board, move, mover(ply))
+        boards.append(board.copy())
+    return boards
+
+def replay_positions(records, sides=None):
+    ''' replays many records at once, collecting the boards after the moves
+        as one list, ready to be encoded in bulk (e.g. by research.states2imgs)
+
+    Args:
+        records: list<bytes>
+            the records of the games
+        sides: list<int>
+            Optional; if given, then only the boards after the moves of the
+            given player (BLACK or WHITE) of each game are collected
+
+    Returns:
+        (boards, players) where players is the player who made the move that
+        lead to each board
+    '''
+    boards = []
+    players = []
+    for i, record in enumerate(records):
+        board = init_board()
+        for ply, move in enumerate(record):
+            player = mover(ply)
+            makemove(board, move, player)
+            if sides is None or sides[i] == player:
+                boards.append(board.copy())
+                players.append(player)
+    return boards, players
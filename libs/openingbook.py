@@ -0,0 +1,136 @@
+''' Opening book.
+
+A table of the best move in the positions of the first plies of the game,
+found offline by a deep alpha-beta search. Positions are stored in their
+canonical form (see libs/symmetry), so a position and its 7 symmetric
+positions share one entry. On disk the book is a .npz file of 4 parallel
+arrays: the black and white bitboards, the player to move and the move.
+
+build with: python -m libs.openingbook [<plies> [<depth> [<path>]]]
+'''
+import sys
+
+import numpy as np
+
+from libs.bitboard import BitBoard, BLACK, from_list
+from libs.symmetry import canonical, SQUARE_MAPS, INVERSE
+
+OPENING_BOOK_PATH = 'archive/opening_book.npz'
+
+def _bitboards(board):
+    if not isinstance(board, BitBoard):
+        board = from_list(board)
+    return board.black, board.white
+
+
+class OpeningBook(object):
+    """ Maps positions to the move to play in them, whatever their symmetry """
+    def __init__(self, positions=None):
+        """
+        Args:
+            positions: dict<(int, int, int), int>
+                Optional; canonical (black, white, player) to the move in the
+                canonical position
+        """
+        self.positions = {} if positions is None else positions
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, board, player, move):
+        """ adds the move to play in the given position """
+        black, white, sym = canonical(*_bitboards(board))
+        self.positions[(black, white, player)] = SQUARE_MAPS[sym][move]
+
+    def lookup(self, board, player):
+        """ the move to play in the given position, or None if the position is
+            not in the book """
+        black, white, sym = canonical(*_bitboards(board))
+        move = self.positions.get((black, white, player))
+        if move is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # map the move of the canonical position back onto the given board
+        return SQUARE_MAPS[INVERSE[sym]][move]
+
+    def save(self, path=OPENING_BOOK_PATH):
+        keys = list(self.positions)
+        np.savez(path,
+            black=np.array([ black for black, _, _ in keys ], dtype=np.uint64),
+            white=np.array([ white for _, white, _ in keys ], dtype=np.uint64),
+            player=np.array([ player for _, _, player in keys ], dtype=np.int8),
+            move=np.array([ self.positions[key] for key in keys ],
+                dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path=OPENING_BOOK_PATH):
+        data = np.load(path)
+        return cls({
+            (int(black), int(white), int(player)): int(move)
+            for black, white, player, move in zip(data['black'],
+                data['white'], data['player'], data['move'])
+        })
+
+
+def build_book(plies=6, depth=8, time_limit=3600, bar=True):
+    """ searches every position of the first plies of the game (up to
+        symmetry) to the given depth
+
+    Args:
+        plies: int
+            positions with up to this many moves played are added
+        depth: int
+            the depth of the search of each position
+        time_limit: float
+            the time limit of the search of each position
+        bar: bool
+            Optional; if True, then a ProgressBar is shown for every ply
+
+    Returns:
+        OpeningBook
+    """
+    from libs.othellogame import (init_board, legalmoves, makemove,
+        legalmoves_with_flips, makemove_with_flips, unmakemove, EAGER_FLIPS)
+    from libs.alphabeta import AlphaBeta, MoveOrdering
+    from libs.alphabeta_mpi import count_discs
+    from libs.util import ProgressBar
+    flips_kwargs = {}
+    if EAGER_FLIPS:
+        flips_kwargs = {'legalmoves_with_flips': legalmoves_with_flips,
+                        'makemove_with_flips': makemove_with_flips}
+    searcher = AlphaBeta(legalmoves, makemove, count_discs, time_limit,
+        unmakemove=unmakemove, ordering=MoveOrdering(), **flips_kwargs)
+    book = OpeningBook()
+    frontier = [ (init_board(), BLACK) ]
+    for ply in range(plies + 1):
+        if bar:
+            print(f"Searching {len(frontier)} positions of ply {ply}...")
+            progress = ProgressBar(len(frontier))
+        next_frontier = {}
+        for board, player in frontier:
+            moves = legalmoves(board, player)
+            if moves != []:
+                book.add(board, player, searcher.get_move(board.copy(),
+                    player, -player, depth))
+                for move in moves if ply < plies else []:
+                    alt = board.copy()
+                    makemove(alt, move, player)
+                    black, white, _ = canonical(*_bitboards(alt))
+                    next_frontier.setdefault((black, white), (alt, -player))
+            if bar:
+                progress.update()
+        frontier = list(next_frontier.values())
+    return book
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    plies = int(args[0]) if len(args) > 0 else 6
+    depth = int(args[1]) if len(args) > 1 else 8
+    path = args[2] if len(args) > 2 else OPENING_BOOK_PATH
+    book = build_book(plies, depth)
+    book.save(path)
+    print(f"Saved {len(book)} positions to {path}")
@@ -1,9 +1,32 @@
+import os
+import random
+
 BLACK = -1
 EMPTY = 0
 WHITE = 1
 OUTER = 3
 ALLDIRECTIONS = [-11, -10, -9, -1, 1, 9, 10, 11]
 
+# engine used for init_board, legalmoves, makemove, get_winner and to_str.
+# set the environment variable OTHELLO_BACKEND=bitboard before importing to
+# use the bitboard engine in libs/bitboard instead of the 10x10 list engine
+BACKEND = os.environ.get('OTHELLO_BACKEND', 'list')
+
+# random keys used for zobrist hashing. the keys are generated from a fixed
+# seed so that the hash of a position is the same across runs and engines
+ZOBRIST_SEED = 2020
+_zobrist_random = random.Random(ZOBRIST_SEED)
+ZOBRIST = { BLACK: [0] * 100, WHITE: [0] * 100 }
+for _row in range(10, 90, 10):
+    for _sq in range(_row+1, _row+9):
+        ZOBRIST[BLACK][_sq] = _zobrist_random.getrandbits(64)
+        ZOBRIST[WHITE][_sq] = _zobrist_random.getrandbits(64)
+ZOBRIST_TURN = _zobrist_random.getrandbits(64) # xor-ed in when WHITE is to move
+
+class BoardList(list):
+    def __repr__(self):
+        return to_str(self)
+
 def init_board():
     ''' initializes a starting board '''
     board = [0] * 100
@@ -20,9 +43,6 @@ def init_board():
     board[45] = BLACK
     board[54] = BLACK
     board[55] = WHITE
-    class BoardList(list):
-        def __repr__(self):
-            return to_str(self)
     return BoardList(board)
 
 def legalmoves(board: list, player: int):
@@ -34,20 +54,59 @@ def legalmoves(board: list, player: int):
                 moves.append(move)
     return moves
 
+def legalmoves_with_flips(board: list, player: int):
+    ''' gets a list of (move, flips) pairs for all of the legal moves for this
+        player, where flips is the list of squares the move would flip '''
+    moves = []
+    for row in range(10, 90, 10):
+        for move in range(row+1, row+9):
+            if board[move] == EMPTY:
+                flips = _flips(board, move, player)
+                if flips:
+                    moves.append((move, flips))
+    return moves
+
+def legalmoves_to_flips(board: list, player: int):
+    ''' gets a dict of each legal move for this player to the flips to give
+        makemove_with_flips() '''
+    return dict(legalmoves_with_flips(board, player))
+
+# whether searches should use legalmoves_with_flips and makemove_with_flips
+# rather than legalmoves and makemove. The list engine finds the flips of a
+# move anyway while checking that it is legal, so keeping them is faster
+EAGER_FLIPS = True
+
 def makemove(board: list, move: int, player:int):
-    ''' makes the given move for the given player '''
+    ''' makes the given move for the given player and returns the undo record
+        that unmakemove() can use to take the move back '''
+    return makemove_with_flips(board, move, _flips(board, move, player), player)
+
+def makemove_with_flips(board: list, move: int, flips: list, player: int):
+    ''' makes the given move using the flips from legalmoves_with_flips() and
+        returns the undo record '''
     board[move] = player
-    for dir in ALLDIRECTIONS:
-        _make_flips(board, move, dir, player)
+    for square in flips:
+        board[square] = player
+    return move, flips, player
+
+def unmakemove(board: list, undo: tuple):
+    ''' takes back the move described by the undo record from makemove() '''
+    move, flips, player = undo
+    board[move] = EMPTY
+    for square in flips:
+        board[square] = -player
     
-def _make_flips(board: list, move: int, dir: int, player: int):
-    ''' performs the flips between players '''
-    would_flip = _would_flip(board, move, dir, player)
-    if would_flip:
-        c = move + dir
-        while c != would_flip:
-            board[c] = player
-            c += dir
+def _flips(board: list, move: int, player: int):
+    ''' gets the squares that would be flipped by the given move '''
+    flips = []
+    for dir in ALLDIRECTIONS:
+        would_flip = _would_flip(board, move, dir, player)
+        if would_flip:
+            c = move + dir
+            while c != would_flip:
+                flips.append(c)
+                c += dir
+    return flips
 
 def _is_legal_move(board: list, move: int, player: int):
     ''' checks whether the given move is legal for the given player '''
@@ -78,6 +137,25 @@ def _find_bracketing_piece(board: list, square: int, dir: int, player: int):
         return square
     return False
 
+def zobrist_hash(board: list, player: int):
+    ''' gets the zobrist hash of the board with player being the one to move '''
+    key = ZOBRIST_TURN if player == WHITE else 0
+    for row in range(10, 90, 10):
+        for sq in range(row+1, row+9):
+            piece = board[sq]
+            if piece != EMPTY:
+                key ^= ZOBRIST[piece][sq]
+    return key
+
+def zobrist_update(key: int, undo: tuple):
+    ''' updates the zobrist hash after the move described by the undo record
+        from makemove(), after which the opponent is to move '''
+    move, flips, player = undo
+    key ^= ZOBRIST[player][move] ^ ZOBRIST_TURN
+    for sq in flips:
+        key ^= ZOBRIST[player][sq] ^ ZOBRIST[-player][sq]
+    return key
+
 def get_winner(board: list):
     ''' gets the winner of the match (the player with the mos discs. '''
     whitepieces = board.count(WHITE)
@@ -100,3 +178,12 @@ def to_str(board):
             for col in range(1, 9)
         ]) + '\n'
     return s
+
+
+if BACKEND == 'bitboard':
+    from libs.bitboard import (init_board, legalmoves, legalmoves_with_flips,
+        legalmoves_to_flips, EAGER_FLIPS, makemove, makemove_with_flips, 
+        unmakemove, zobrist_hash, zobrist_update, get_winner, to_str, 
+        from_list, to_list)
+elif BACKEND != 'list':
+    raise ValueError(f"Unknown OTHELLO_BACKEND: {BACKEND}")
@@ -0,0 +1,70 @@
+''' The 8 symmetries of the othello board.
+
+Every symmetry of the square is a combination of a flip along the a1-h8
+diagonal, a vertical flip (rows reversed) and a horizontal flip (columns
+reversed). Symmetry s applies the diagonal flip if bit 2 of s is set, then the
+vertical flip if bit 1 is set, then the horizontal flip if bit 0 is set, so 0
+is the identity. Boards are transformed as bitboards (see libs/bitboard) with
+delta swaps, and moves with the square maps.
+'''
+from libs.bitboard import FULL, SQUARES, SQ2BIT, BIT2SQ
+
+SYMMETRIES = range(8)
+
+def flip_vertical(x: int):
+    ''' reverses the rows, i.e. the bytes '''
+    return int.from_bytes(x.to_bytes(8, 'little'), 'big')
+
+def flip_horizontal(x: int):
+    ''' reverses the columns, i.e. the bits within each byte '''
+    x = ((x >> 1) & 0x5555555555555555) | ((x & 0x5555555555555555) << 1)
+    x = ((x >> 2) & 0x3333333333333333) | ((x & 0x3333333333333333) << 2)
+    x = ((x >> 4) & 0x0F0F0F0F0F0F0F0F) | ((x & 0x0F0F0F0F0F0F0F0F) << 4)
+    return x
+
+def flip_diagonal(x: int):
+    ''' swaps rows and columns, i.e. flips along the a1-h8 diagonal '''
+    t = 0x0F0F0F0F00000000 & (x ^ (x << 28))
+    x ^= t ^ (t >> 28)
+    t = 0x3333000033330000 & (x ^ (x << 14))
+    x ^= t ^ (t >> 14)
+    t = 0x5500550055005500 & (x ^ (x << 7))
+    x ^= t ^ (t >> 7)
+    return x & FULL
+
+def transform(x: int, sym: int):
+    ''' applies symmetry sym to the bitboard x '''
+    if sym & 4:
+        x = flip_diagonal(x)
+    if sym & 2:
+        x = flip_vertical(x)
+    if sym & 1:
+        x = flip_horizontal(x)
+    return x
+
+# SQUARE_MAPS[sym][square] is the square that square is moved to by sym
+SQUARE_MAPS = [
+    { sq: BIT2SQ[transform(SQ2BIT[sq], sym).bit_length() - 1]
+      for sq in SQUARES }
+    for sym in SYMMETRIES
+]
+# INVERSE[sym] is the symmetry that undoes sym
+INVERSE = [
+    next(inv for inv in SYMMETRIES
+         if all(SQUARE_MAPS[inv][SQUARE_MAPS[sym][sq]] == sq for sq in SQUARES))
+    for sym in SYMMETRIES
+]
+
+def canonical(black: int, white: int):
+    ''' finds the smallest (black, white) pair among the 8 symmetric positions
+
+    Returns:
+        (black, white, sym) where sym is the symmetry that maps the given
+        position onto the canonical one
+    '''
+    best = None
+    for sym in SYMMETRIES:
+        key = (transform(black, sym), transform(white, sym), sym)
+        if best is None or key < best:
+            best = key
+    return best
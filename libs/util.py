@@ -9,8 +9,8 @@ class ProgressBar(object):
         else:
             self.time_start = time_start
         update_progress(self.completed, self.to_complete, self.time_start)
-    def update(self):
-        self.completed += 1
+    def update(self, count=1):
+        self.completed += count
         update_progress(self.completed, self.to_complete, self.time_start)
     def finish(self):
         update_progress(self.to_complete, self.to_complete, self.time_start)
@@ -160,4 +160,24 @@ def pickle_load(filename):
     file = open(filename, 'rb')
     data = pickle.load(file)
     file.close()
-    return data
\ No newline at end of file
+    return data
+
+import os
+def drop_generations(filename, first_generation):
+    ''' removes the rows of a tab separated file (with a header row) whose
+        generation, the first column, is first_generation or later. Used when
+        resuming an experiment to drop the rows of a generation whose save
+        phase did not finish '''
+    file = open(filename)
+    lines = file.readlines()
+    file.close()
+    kept = lines[:1] + [ 
+        line for line in lines[1:] 
+        if int(line.split('\t', 1)[0]) < first_generation 
+    ]
+    if len(kept) == len(lines):
+        return
+    file = open(f'{filename}.tmp', 'w')
+    file.writelines(kept)
+    file.close()
+    os.replace(f'{filename}.tmp', filename)
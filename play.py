@@ -10,13 +10,14 @@ def play_match(p1, p2):
     color2player = [0, p2, p1]
     # start game
     while True:
-        moves = legalmoves(board, curr_turn)
-        if moves == []:
+        move2flips = legalmoves_to_flips(board, curr_turn)
+        if not move2flips:
            return board.count(BLACK), board.count(WHITE)
+        moves = list(move2flips)
         # get the best move
         move = color2player[curr_turn].choosemove(board, moves, curr_turn)
         # make that move
-        makemove(board, move, curr_turn)
+        makemove_with_flips(board, move, move2flips[move], curr_turn)
         # pass turn
         curr_turn = -curr_turn
 
@@ -27,51 +28,413 @@ def play2matches(p1, p2):
     round2 = w_pieces - b_pieces
     return round1, round2
 
+import numpy as np
+from libs.gamerecord import encode_moves
+def play_matches(pairings, record=False, bar=None):
+    ''' plays the matches between each (black player, white player) pair of
+        pairings at the same time, one ply at a time. The candidate boards of
+        all the games in which a model player is to move are scored together, 
+        so each model is called once per ply instead of once per move of every
+        game.
+
+    Args:
+        pairings: list<(player, player)>
+            the black and white player of each match
+        record: bool
+            Optional; if True, then the moves of every match are recorded as
+            bytes (see libs/gamerecord), like record_match in experiment1
+        bar: ProgressBar
+            Optional; updated every time a match finishes
+
+    Returns:
+        list containing (b_pieces, w_pieces) for each match, or 
+        (recording, b_pieces, w_pieces) if record is True, in the order of the 
+        pairings
+    '''
+    boards = [ init_board() for _ in pairings ]
+    recordings = [ [] for _ in pairings ]
+    results = [ None ] * len(pairings)
+    active = list(range(len(pairings)))
+    curr_turn = BLACK
+    while active:
+        # moves and flips of every game still being played
+        game2moves = {}
+        for game in active:
+            move2flips = legalmoves_to_flips(boards[game], curr_turn)
+            if not move2flips:
+                board = boards[game]
+                results[game] = (board.count(BLACK), board.count(WHITE))
+                if bar is not None:
+                    bar.update()
+            else:
+                game2moves[game] = move2flips
+        active = list(game2moves)
+        # choose the moves, collecting the images of all the games that 
+        # are scored by the same model into one batch. The agents of a 
+        # Population are all scored by the same call
+        game2move = {}
+        model2batch = {}
+        for game in active:
+            player = pairings[game][0 if curr_turn == BLACK else 1]
+            moves = list(game2moves[game])
+            if hasattr(player, 'candidate_imgs'):
+                move = player.book_move(boards[game], moves, curr_turn)
+                if move is not None:
+                    game2move[game] = move
+                    continue
+                imgs = player.candidate_imgs(boards[game], moves, curr_turn)
+                # only the images that are not cached are scored by the model
+                cached = None
+                if player.cache is not None:
+                    keys = player.cache.keys(player.model, imgs)
+                    known = player.cache.lookup(keys)
+                    missed = np.isnan(known)
+                    if not missed.any():
+                        game2move[game] = moves[np.argmax(known)]
+                        continue
+                    imgs = imgs[missed]
+                    cached = (player.cache, keys, known, missed)
+                model = getattr(player.model, 'population', player.model)
+                batch = model2batch.setdefault(id(model), (model, [], [], []))
+                batch[1].append(imgs)
+                batch[2].append((game, moves, cached))
+                if model is not player.model:
+                    batch[3].append(np.full(len(imgs), player.model.index))
+            else:
+                game2move[game] = player.choosemove(boards[game], moves, 
+                    curr_turn)
+        for model, imgs, game_moves, indices in model2batch.values():
+            if indices:
+                scores = model.predict(np.concatenate(indices), 
+                    np.concatenate(imgs))
+            else:
+                scores = model.predict(np.concatenate(imgs))
+            scores = np.ravel(scores)
+            start = 0
+            for (game, moves, cached), game_imgs in zip(game_moves, imgs):
+                end = start + len(game_imgs)
+                game_scores = scores[start:end]
+                if cached is not None:
+                    cache, keys, game_scores, missed = cached
+                    game_scores[missed] = scores[start:end]
+                    cache.store([ key for key, miss in zip(keys, missed) 
+                        if miss ], scores[start:end])
+                game2move[game] = moves[np.argmax(game_scores)]
+                start = end
+        # make the moves
+        for game in active:
+            move = game2move[game]
+            makemove_with_flips(boards[game], move, game2moves[game][move], 
+                curr_turn)
+            if record:
+                recordings[game].append(move)
+        # pass turn
+        curr_turn = -curr_turn
+    if record:
+        return [ 
+            (encode_moves(recording), b_pieces, w_pieces) 
+            for recording, (b_pieces, w_pieces) in zip(recordings, results)
+        ]
+    return results
+
+from libs.othellogame import BACKEND
+from libs.bitboard import SQ2BIT, mask2squares, to_list
+from libs.batchboard import BoardBatch, BIT2SQ_ARRAY
+def play_many(p1, p2, n, record=False, bar=None):
+    ''' plays n games of p1 (black) against p2 (white) at the same time on a
+        BoardBatch (see libs/batchboard), finding the legal moves and making 
+        the moves of all the games with vectorized operations. Players with a
+        choosemoves method (e.g. ModelPlayer and RandomPlayer) choose the 
+        moves of all the games in one call; the other players are asked for
+        the move of each game in turn, like in play_match, on a board of the
+        engine of libs/othellogame.
+
+    Args:
+        p1, p2: player
+            the black and the white player
+        n: int
+            the number of games
+        record: bool
+            Optional; if True, then the moves of every game are recorded as
+            bytes (see libs/gamerecord)
+        bar: ProgressBar
+            Optional; updated every time a game finishes
+
+    Returns:
+        list containing (b_pieces, w_pieces) for each game, like play_match, 
+        or (recording, b_pieces, w_pieces) if record is True
+    '''
+    games = BoardBatch(n)
+    recordings = np.zeros((n, 60), dtype=np.uint8)
+    color2player = [0, p2, p1]
+    ply = 0
+    while True:
+        legal = games.legal_masks()
+        ended = games.end(legal)
+        if bar is not None:
+            for _ in ended:
+                bar.update()
+        playing = np.flatnonzero(~games.done)
+        if len(playing) == 0:
+            break
+        player = color2player[games.player]
+        if hasattr(player, 'choosemoves'):
+            own, opp = games.discs(playing)
+            moves = player.choosemoves(own, opp, legal[playing])
+        else:
+            moves = []
+            for game, mask in zip(playing, legal[playing]):
+                # the board of the engine the player was made with
+                board = games.board(game)
+                if BACKEND != 'bitboard':
+                    board = to_list(board)
+                move = player.choosemove(board, mask2squares(int(mask)), 
+                    games.player)
+                moves.append(SQ2BIT[move].bit_length() - 1)
+            moves = np.array(moves)
+        if record:
+            recordings[playing, ply] = BIT2SQ_ARRAY[moves]
+        games.play(playing, moves)
+        ply += 1
+    results = [ 
+        (int(b_pieces), int(w_pieces)) 
+        for b_pieces, w_pieces in zip(*games.counts()) 
+    ]
+    if record:
+        # every move adds one disc to the 4 of the starting board
+        return [
+            (encode_moves(recording[:b_pieces + w_pieces - 4]), b_pieces, 
+                w_pieces)
+            for recording, (b_pieces, w_pieces) in zip(recordings, results)
+        ]
+    return results
+
 from players import *
-from research import state2img
-ab3 = AlphaBetaPlayer(legalmoves, makemove, 3)
-ab5 = AlphaBetaPlayer(legalmoves, makemove, 5)
-ab7 = AlphaBetaMPIPlayer(legalmoves, makemove, 7)
-ab2player = { 'ab3': ab3, 'ab5': ab5, 'ab7': ab7 }
+from research import state2img, states2imgs, NumpyModel
+from libs.alphabeta import MoveOrdering
+alphabeta_kwargs = {
+    'unmakemove': unmakemove,
+    'zobrist_hash': zobrist_hash,
+    'zobrist_update': zobrist_update,
+}
+if EAGER_FLIPS:
+    alphabeta_kwargs.update(legalmoves_with_flips=legalmoves_with_flips,
+        makemove_with_flips=makemove_with_flips)
+import os
+import functools
+from libs.openingbook import OpeningBook, OPENING_BOOK_PATH
+AB_NAMES = ('ab3', 'ab5', 'ab7')
 rand_player = RandomPlayer()
-standard_players = [ 
-    ModelPlayer(model, makemove, state2img) 
-    for model in load_standard_models()
-]
 
-from libs.util import ProgressBar
-def assess_top(top_model):
+# the opening book, the alpha-beta players and the standard players are only 
+# made the first time they are used (as play.ab3, play.standard_players etc.,
+# see __getattr__), so importing play does not load them
+
+@functools.lru_cache(maxsize=None)
+def load_opening_book():
+    ''' the opening book, or None if it has not been built yet '''
+    # built offline with: python -m libs.openingbook
+    if os.path.isfile(OPENING_BOOK_PATH):
+        return OpeningBook.load(OPENING_BOOK_PATH)
+    return None
+
+def make_ab_player(ab_num, opening_book=None):
+    ''' a new alpha-beta player of the given name '''
+    if ab_num == 'ab7':
+        return AlphaBetaYBWPlayer(legalmoves, makemove, 7, 
+            ordering=MoveOrdering(), book=opening_book, **alphabeta_kwargs)
+    depth = { 'ab3': 3, 'ab5': 5 }[ab_num]
+    return AlphaBetaPlayer(legalmoves, makemove, depth, iterative=True,
+        ordering=MoveOrdering(), book=opening_book, **alphabeta_kwargs)
+
+@functools.lru_cache(maxsize=None)
+def load_ab2player():
+    ''' the alpha-beta players by name '''
+    opening_book = load_opening_book()
+    return { ab_num: make_ab_player(ab_num, opening_book) 
+             for ab_num in AB_NAMES }
+
+@functools.lru_cache(maxsize=None)
+def load_standard_players():
+    ''' the players of the 10 unseen, untrained standard models '''
+    return [ 
+        ModelPlayer(agent, makemove, state2img, states2imgs) 
+        for agent in load_standard_models()
+    ]
+
+def __getattr__(name):
+    if name == 'opening_book':
+        return load_opening_book()
+    if name == 'ab2player':
+        return load_ab2player()
+    if name in AB_NAMES:
+        return load_ab2player()[name]
+    if name == 'standard_players':
+        return load_standard_players()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+import random
+import itertools
+import multiprocessing.util
+import concurrent.futures
+from libs.util import ProgressBar, pickle_dump, pickle_load
+# moves chosen by the alpha-beta players, kept between generations
+AB_MOVES_PATH = 'archive/ab_moves.pkl'
+# the most moves kept per alpha-beta player
+AB_MOVES_LIMIT = 2**17
+
+def load_ab_moves(path=AB_MOVES_PATH):
+    ''' loads the moves cached by the alpha-beta players as a dict of the 
+        player's name to a dict of position_key to move '''
+    if not os.path.isfile(path):
+        return { ab_num: {} for ab_num in AB_NAMES }
+    return pickle_load(path)
+
+def prune_ab_moves(ab_moves, limit=AB_MOVES_LIMIT):
+    ''' keeps only the limit moves last added for each player '''
+    for ab_num, moves in ab_moves.items():
+        if len(moves) > limit:
+            ab_moves[ab_num] = dict(itertools.islice(moves.items(), 
+                len(moves) - limit, None))
+
+def save_ab_moves(ab_moves, path=AB_MOVES_PATH):
+    # written to a temporary file first, so a crash never leaves it half done
+    pickle_dump(data=ab_moves, filename=f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+
+# set in each worker process by _init_assess_worker
+_model_player = None
+_opponents = None
+_ab_moves_path = None
+
+def _init_assess_worker(weights, ab_moves_path):
+    global _model_player, _opponents, _ab_moves_path
+    # the workers are forked with the same random state
+    random.seed()
+    _model_player = ModelPlayer(NumpyModel(weights), makemove, state2img, 
+        states2imgs)
+    _opponents = { 'rand': rand_player }
+    _ab_moves_path = ab_moves_path
+    # the worker processes of ab7 must be shut down before the worker exits,
+    # otherwise the worker waits for them forever when the pool is closed.
+    # This has to run before the finalizers of the queues of those processes
+    # (exitpriority 10), which would stop them from being told to shut down
+    multiprocessing.util.Finalize(None, _close_opponents, exitpriority=100)
+
+def _close_opponents():
+    for opponent in _opponents.values():
+        searcher = getattr(getattr(opponent, 'player', None), 'alphabeta', None)
+        if hasattr(searcher, 'close'):
+            searcher.close()
+
+def _search_stats(opponent):
+    ''' the searches, nodes and transposition table counters of the 
+        alpha-beta search of the opponent since they were last taken, or None
+        if it has no such search. For ab7 the table is that of the master 
+        process, as its worker processes keep their own '''
+    searcher = getattr(getattr(opponent, 'player', None), 'alphabeta', None)
+    if searcher is None:
+        return None
+    stats = { 'searches': len(searcher.nodes_log), 
+              'nodes': sum(searcher.nodes_log) }
+    searcher.nodes_log = []
+    tt = getattr(getattr(searcher, 'local', searcher), 'tt', None)
+    if tt is not None:
+        stats.update(tt_hits=tt.hits, tt_misses=tt.misses, 
+            tt_cutoffs=tt.cutoffs)
+        tt.hits = tt.misses = tt.cutoffs = 0
+    return stats
+
+def _opponent(name):
+    ''' the opponent of the given name, made the first time the worker plays
+        against it. The alpha-beta players are the worker's own, so no search
+        processes are shared with the process that forked it, and only their 
+        own cached moves are loaded '''
+    opponent = _opponents.get(name)
+    if opponent is None:
+        if name in AB_NAMES:
+            opponent = CachedPlayer(make_ab_player(name, load_opening_book()),
+                load_ab_moves(_ab_moves_path).get(name))
+        else:
+            opponent = load_standard_players()[int(name[1:])]
+        _opponents[name] = opponent
+    return opponent
+
+def _assess_pair(name):
+    ''' plays both sides against the opponent of the given name 
+
+    Returns:
+        (sum of the disc differentials, moves newly cached by the opponent,
+         the search stats of the opponent (see _search_stats))
+    '''
+    opponent = _opponent(name)
+    score = sum(play2matches(_model_player, opponent))
+    new_moves = getattr(opponent, 'new_moves', {})
+    if new_moves:
+        opponent.new_moves = {}
+    return score, new_moves, _search_stats(opponent)
+
+def print_search_stats(name, stats):
+    ''' prints the search stats of an alpha-beta opponent from _assess_pair '''
+    line = f"{name}: {stats['searches']} searches, {stats['nodes']} nodes"
+    if 'tt_hits' in stats:
+        probes = stats['tt_hits'] + stats['tt_misses']
+        hit_rate = stats['tt_hits'] / probes if probes else 0
+        line += (f", TT {stats['tt_hits']}/{probes} hits ({hit_rate:.1%}), "
+                 f"{stats['tt_cutoffs']} cutoffs")
+    print(line)
+
+def assess_top(top_model, max_workers=None, ab_moves_path=AB_MOVES_PATH):
     """ Assesses this model against alpha-beta players whom looks 3, 5 and 7
         moves ahead respectively as well as the average performance against 10
-        players that perform random moves and 10 unseen, untrained models
+        players that perform random moves and 10 unseen, untrained models.
+
+        The match pairs are played at the same time by worker processes. The 
+        alpha-beta players are deterministic, so their moves are cached by 
+        position in ab_moves_path and reused in later calls. The workers make
+        their opponents, and load the cached moves, themselves. The nodes 
+        searched by each alpha-beta player and the counters of its 
+        transposition table are printed.
     
     Args:
         top_model: keras.Model
             the model to assess
+        max_workers: int
+            Optional; the number of worker processes. Defaults to the number 
+            of processors
+        ab_moves_path: str
+            Optional; the file the moves of the alpha-beta players are kept in
     
     Returns:
         list containing the performance against ab3, ab5, ab7, r10, n10 
         respectively in the order as described above.
     """
-    model_player = ModelPlayer(top_model, makemove, state2img)
-    performance = []
-    # play against alphabeta players
+    # the standard models are counted without making their players
+    num_standard = len(pickle_load(STANDARD_MODELS_PATH))
+    names = list(AB_NAMES) + [ 'rand' ] * 10 + \
+        [ f'n{i}' for i in range(num_standard) ]
+    # play against alphabeta players, random moves and new models
     print(f"Assessing Performance...")
-    bar = ProgressBar(3 + 10 + 10)
-    for ab_num, ab_player in ab2player.items():
-        performance.append(sum(play2matches(model_player, ab_player)))
-        bar.update()
-    # play against random moves
-    r10 = 0
-    for _ in range(10):
-        r10 += sum(play2matches(model_player, rand_player))
-        bar.update()
-    performance.append(r10 / 10)
-    # play against new models
-    n10 = 0
-    for standard_player in standard_players:
-        n10 += sum(play2matches(model_player, standard_player))
-        bar.update()
+    bar = ProgressBar(len(names))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+            initializer=_init_assess_worker, 
+            initargs=(top_model.get_weights(), ab_moves_path)) as executor:
+        futures = [ executor.submit(_assess_pair, name) for name in names ]
+        for _ in concurrent.futures.as_completed(futures):
+            bar.update()
+    ab_moves = load_ab_moves(ab_moves_path)
+    name2scores = { name: [] for name in names }
+    for name, future in zip(names, futures):
+        score, new_moves, stats = future.result()
+        name2scores[name].append(score)
+        if name in AB_NAMES:
+            ab_moves.setdefault(name, {}).update(new_moves)
+            print_search_stats(name, stats)
+    prune_ab_moves(ab_moves)
+    save_ab_moves(ab_moves, ab_moves_path)
+    performance = [ name2scores[ab_num][0] for ab_num in AB_NAMES ]
+    performance.append(sum(name2scores['rand']) / 10)
+    n10 = sum(sum(name2scores[f'n{i}']) for i in range(num_standard))
     performance.append(n10 / 10)
     # send back performance data
     return performance
@@ -1,20 +1,67 @@
 import numpy as np
+from libs.batchboard import candidate_boards, random_bits
+from research import bitboards2imgs
 class ModelPlayer():
     ''' Represents a player that makes decisions based on a nueral network '''
-    def __init__(self, model, makemove, state2img):
+    def __init__(self, model, makemove, state2img, states2imgs=None, 
+                 book=None, cache=None):
+        ''' states2imgs is optional; if given, it is used to create the images
+            of all the candidate boards at once. book is an optional 
+            OpeningBook consulted before the model and cache an optional
+            EvaluationCache of the scores of the model '''
         self.model = model
         self.makemove = makemove
         self.state2img = state2img
+        self.states2imgs = states2imgs
+        self.book = book
+        self.cache = cache
 
-    def choosemove(self, board, moves, player):
-        imgs = []
+    def book_move(self, board, moves, player):
+        ''' the move of the opening book, or None if there is none '''
+        if self.book is None:
+            return None
+        move = self.book.lookup(board, player)
+        return move if move in moves else None
+
+    def candidate_imgs(self, board, moves, player):
+        ''' creates the images of the boards after each of the moves, which 
+            are scored by the model to choose the move '''
+        alts = []
         for move in moves:
             alt = board.copy()
             self.makemove(alt, move, player)
-            imgs.append(self.state2img(alt, player))
-        move_index = np.argmax(self.model.predict(imgs))
+            alts.append(alt)
+        if self.states2imgs is not None:
+            return self.states2imgs(alts, player)
+        return np.array([ self.state2img(alt, player) for alt in alts ])
+
+    def choosemove(self, board, moves, player):
+        move = self.book_move(board, moves, player)
+        if move is not None:
+            return move
+        imgs = self.candidate_imgs(board, moves, player)
+        if self.cache is not None:
+            move_index = np.argmax(self.cache.predict(self.model, imgs))
+        else:
+            move_index = np.argmax(self.model.predict(imgs))
         return moves[move_index]
 
+    def choosemoves(self, own, opp, legal):
+        ''' chooses the moves of many games at once (see play.play_many). The
+            games are given as the uint64 masks of the discs of the player to
+            move, of the opponent and of the legal moves. Returns the bit 
+            index of the move of each game. The opening book is not used '''
+        games, moves, alt_own, alt_opp = candidate_boards(own, opp, legal)
+        imgs = bitboards2imgs(alt_own, alt_opp)
+        if self.cache is not None:
+            scores = self.cache.predict(self.model, imgs)
+        else:
+            scores = self.model.predict(imgs)
+        # the first of the best moves of each game, like np.argmax
+        order = np.lexsort((-np.ravel(scores), games))
+        first = np.flatnonzero(np.diff(games[order], prepend=-1))
+        return moves[order[first]]
+
 
 import random
 class RandomPlayer():
@@ -23,11 +70,69 @@ class RandomPlayer():
     def choosemove(self, board, moves, player):
         return random.choice(moves)
 
+    def choosemoves(self, own, opp, legal):
+        ''' chooses random moves for many games at once, seeded from random
+            so random.seed() also seeds them '''
+        rng = np.random.default_rng(random.getrandbits(64))
+        return random_bits(legal, rng)
+
+
+from libs.bitboard import BitBoard, from_list
+def position_key(board, player):
+    ''' a hashable key of the position, the (black, white) masks of the 
+        discs and the player, for either board engine '''
+    if not isinstance(board, BitBoard):
+        board = from_list(board)
+    return board.black, board.white, player
+
+class CachedPlayer():
+    '''Wraps a deterministic player, remembering the move it chose in every 
+       position so the same position is never searched twice'''
+    def __init__(self, player, moves=None):
+        ''' moves is an optional dict of position_key to the move chosen, such
+            as the moves of an earlier CachedPlayer '''
+        self.player = player
+        self.moves = {} if moves is None else moves
+        self.new_moves = {} # moves chosen since the player was created
+    def choosemove(self, board, moves, player):
+        key = position_key(board, player)
+        move = self.moves.get(key)
+        if move is None:
+            move = self.player.choosemove(board, moves, player)
+            self.moves[key] = move
+            self.new_moves[key] = move
+        return move
+
+
+from libs.othellogame import EMPTY
+from libs.endgame import EndgameSolver
+class EndgamePlayer():
+    '''Base for the search players, which play the move of the opening book
+       while the position is in it and solve the game exactly once no more
+       than endgame_empties empty squares are left'''
+    def __init__(self, endgame_empties, book=None):
+        self.endgame_empties = endgame_empties
+        self.endgame = EndgameSolver()
+        self.book = book
+    def choosemove(self, board, moves, player):
+        if self.book is not None:
+            move = self.book.lookup(board, player)
+            if move in moves:
+                return move
+        if board.count(EMPTY) <= self.endgame_empties:
+            move, _ = self.endgame.solve(board, player)
+            return move
+        return self.search(board, moves, player)
 
 from libs.alphabeta import AlphaBeta
-class AlphaBetaPlayer():
+class AlphaBetaPlayer(EndgamePlayer):
     '''Interface to play against the AlphaBetaPlayer'''
-    def __init__(self, legalmoves, makemove, depth):
+    def __init__(self, legalmoves, makemove, depth, endgame_empties=8,
+                 book=None, **alphabeta_kwargs):
+        ''' book is an optional OpeningBook. alphabeta_kwargs are the optional
+            arguments of AlphaBeta, such as legalmoves_with_flips, unmakemove 
+            and zobrist_hash '''
+        super().__init__(endgame_empties, book)
         self.depth = depth
         def evaluate(board, player):
             return board.count(player)
@@ -35,28 +140,53 @@ class AlphaBetaPlayer():
             legalmoves, 
             makemove, 
             evaluate, 
-            time_limit=5)
-    def choosemove(self, board, moves, player):
-        return self.alphabeta.get_move(board, player, -player, self.depth)
+            time_limit=5,
+            **alphabeta_kwargs)
+    def search(self, board, moves, player):
+        # search on a copy since an in place search works on the given board
+        return self.alphabeta.get_move(board.copy(), player, -player, 
+            self.depth)
 
-from libs.alphabeta_mpi import AlphaBetaMPI
-class AlphaBetaMPIPlayer():
+from libs.alphabeta_mpi import AlphaBetaMPI, count_discs
+class AlphaBetaMPIPlayer(EndgamePlayer):
     '''Interface to play against the AlphaBetaPlayer'''
-    def __init__(self, legalmoves, makemove, depth):
+    def __init__(self, legalmoves, makemove, depth, endgame_empties=8,
+                 book=None, **alphabeta_kwargs):
+        ''' book is an optional OpeningBook. alphabeta_kwargs are the optional
+            arguments of AlphaBetaMPI, such as max_workers, 
+            legalmoves_with_flips and zobrist_hash '''
+        super().__init__(endgame_empties, book)
         self.depth = depth
-        def evaluate(board, player):
-            return board.count(player)
         self.alphabeta = AlphaBetaMPI(
             legalmoves, 
             makemove, 
-            evaluate, 
-            time_limit=5)
-    def choosemove(self, board, moves, player):
+            count_discs, 
+            time_limit=5,
+            **alphabeta_kwargs)
+    def search(self, board, moves, player):
         return self.alphabeta.get_move(board, player, -player, self.depth)
 
+from libs.alphabeta_ybw import AlphaBetaYBW
+class AlphaBetaYBWPlayer(AlphaBetaMPIPlayer):
+    '''Interface to play against the parallel principal variation search'''
+    def __init__(self, legalmoves, makemove, depth, endgame_empties=8,
+                 book=None, **alphabeta_kwargs):
+        ''' book is an optional OpeningBook. alphabeta_kwargs are the optional
+            arguments of AlphaBetaYBW, such as max_workers, min_split_depth 
+            and legalmoves_with_flips '''
+        EndgamePlayer.__init__(self, endgame_empties, book)
+        self.depth = depth
+        self.alphabeta = AlphaBetaYBW(
+            legalmoves, 
+            makemove, 
+            count_discs, 
+            time_limit=5,
+            **alphabeta_kwargs)
+
 from libs.util import pickle_load
 from research import deserialize_pop
-def load_standard_models():
+STANDARD_MODELS_PATH = 'archive/standard_players.pkl'
+def load_standard_models(path=STANDARD_MODELS_PATH):
     # create the standard assessment players
-    return deserialize_pop(pickle_load('archive/standard_players.pkl'))
+    return deserialize_pop(pickle_load(path))
 
@@ -1,34 +1,428 @@
-from libs.othellogame import WHITE, BLACK
+import itertools
+import collections
+import numpy as np
+from libs.bitboard import BitBoard
+from libs.symmetry import canonical
+
+# indices of the 64 playable squares of the 10x10 board layout, row by row
+SQUARES = np.array([ row + col for row in range(10, 90, 10) 
+                               for col in range(1, 9) ])
+# vector of a square indexed by piece * player, i.e. 1 for the player's own
+# pieces (good), -1 for the opponent's (bad, the last row) and 0 for empty
+PIECE2VECTOR = np.array([
+    [0, 0], # neutral
+    [1, 0], # good
+    [0, 1], # bad
+], dtype=np.float32)
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+def _board_squares(board):
+    """ gets the 64 playable squares of the board as an int8 array """
+    if isinstance(board, BitBoard):
+        black = (np.uint64(board.black) >> _BIT_SHIFTS) & np.uint64(1)
+        white = (np.uint64(board.white) >> _BIT_SHIFTS) & np.uint64(1)
+        return white.astype(np.int8) - black.astype(np.int8)
+    return np.asarray(board, dtype=np.int8)[SQUARES]
+
+def states2imgs(boards, players, dtype=np.float32):
+    """ creates the images of a stack of boards, each from the perspective of
+        the corresponding player
+
+    Args:
+        boards: list<board> or numpy.ndarray
+            the boards, or an (N, 100) array of boards in the 10x10 layout
+        players: list<int> or int
+            the player of each board, or one player for all of them
+        dtype:
+            the dtype of the images
+
+    Returns:
+        numpy.ndarray of shape (N, 64, 2)
+    """
+    if isinstance(boards, np.ndarray):
+        squares = boards[:, SQUARES].astype(np.int8)
+    elif len(boards) == 0:
+        return np.zeros((0, 64, 2), dtype=dtype)
+    else:
+        squares = np.stack([ _board_squares(board) for board in boards ])
+    players = np.asarray(players, dtype=np.int8).reshape(-1, 1)
+    return PIECE2VECTOR.astype(dtype, copy=False)[squares * players]
+
+def bitboards2imgs(own, opp, dtype=np.float32):
+    """ creates the images of a stack of boards given as uint64 masks (see
+        libs/batchboard), own being the discs of the player whose perspective
+        the images are from """
+    from libs.batchboard import unpack_bits
+    return np.stack([ unpack_bits(own), unpack_bits(opp) ], axis=2).astype(
+        dtype)
+
 def state2img(board, player):
     ''' create an image from the given board, from the given player's 
         persepctive '''
-    good = [1, 0]
-    bad = [0, 1]
-    neutral = [0, 0]
-
-    if player == WHITE:
-        piece2vector = [
-            neutral, # EMPTY 0
-            good, # WHITE 1
-            bad, # BLACK -1
-        ]
-    else:
-        piece2vector = [
-            neutral, # EMPTY 0
-            bad, # WHITE 1
-            good, # BLACK -1
-        ]
-    img = []
-    for row in range(10, 90, 10):
-        for piece in board[row+1:row+9]:
-            img.append(piece2vector[piece])
-    return img
-
-import tensorflow as tf
-from tensorflow import keras
+    return PIECE2VECTOR[_board_squares(board) * np.int8(player)]
+
+# every set of weights gets a new version, so scores cached for old weights 
+# are never used for new ones
+_weights_versions = itertools.count()
+
+class NumpyModel(object):
+    """ Scores images like the model of generate_model, but with two matrix
+        products in numpy instead of a call to keras.Model.predict. Both of
+        its layers are linear, so it can stand in for the model anywhere only
+        predict, get_weights or set_weights are used, such as ModelPlayer """
+    def __init__(self, weights):
+        """
+        Args:
+            weights: list<numpy.ndarray>
+                the weights of the model as returned by keras.Model.get_weights,
+                i.e. [ kernel (128, 16), bias (16,), kernel (16, 1), bias (1,) ]
+        """
+        self.set_weights(weights)
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(model.get_weights())
+
+    def get_weights(self):
+        return [ self.w1, self.b1, self.w2, self.b2 ]
+
+    def set_weights(self, weights):
+        w1, b1, w2, b2 = weights
+        self.w1 = np.asarray(w1, dtype=np.float32)
+        self.b1 = np.asarray(b1, dtype=np.float32)
+        self.w2 = np.asarray(w2, dtype=np.float32)
+        self.b2 = np.asarray(b2, dtype=np.float32)
+        self.version = next(_weights_versions)
+
+    def predict(self, imgs):
+        """ scores an (N, 64, 2) array of images, returning an (N, 1) array
+            like keras.Model.predict """
+        imgs = np.asarray(imgs, dtype=np.float32)
+        hidden = imgs.reshape(len(imgs), self.w1.shape[0]) @ self.w1 + self.b1
+        return hidden @ self.w2 + self.b2
+
+    def check_parity(self, model, imgs, rtol=1e-4, atol=1e-5):
+        """ asserts that the scores of the images are the same as those of
+            the keras model, within the given tolerance
+
+        Returns:
+            the largest absolute difference between the scores
+        """
+        expected = np.asarray(model.predict(imgs, verbose=0))
+        actual = self.predict(imgs)
+        diff = float(np.abs(expected - actual).max(initial=0))
+        assert np.allclose(expected, actual, rtol=rtol, atol=atol), \
+            f"NumpyModel differs from the keras model by {diff:.2e}"
+        return diff
+
+# shapes of the weights of generate_model, in the order of get_weights
+WEIGHT_SHAPES = [ (8*8*2, 16), (16,), (16, 1), (1,) ]
+WEIGHT_SIZES = [ int(np.prod(shape)) for shape in WEIGHT_SHAPES ]
+NUM_WEIGHTS = sum(WEIGHT_SIZES)
+
+def random_weights(rng=None):
+    """ weights for a new agent, initialized like the keras layers of 
+        generate_model: glorot uniform kernels and zero biases """
+    if rng is None:
+        rng = np.random.default_rng()
+    weights = []
+    for shape in WEIGHT_SHAPES:
+        if len(shape) == 2:
+            limit = np.sqrt(6 / sum(shape))
+            weights.append(rng.uniform(-limit, limit, shape).astype(np.float32))
+        else:
+            weights.append(np.zeros(shape, dtype=np.float32))
+    return weights
+
+def flatten_weights(weights):
+    """ the weights of an agent as one (NUM_WEIGHTS,) array """
+    return np.concatenate([ np.ravel(w) for w in weights ])
+
+class Population(object):
+    """ The weights of a whole population of models of generate_model held in
+        one contiguous (P, NUM_WEIGHTS) array. The candidate positions of many
+        agents can be scored by one vectorized operation, and a keras model is
+        only built when an agent has to be trained (see fit) """
+    def __init__(self, weights):
+        """
+        Args:
+            weights: list<list<numpy.ndarray>> or numpy.ndarray
+                the weights of each agent as returned by 
+                keras.Model.get_weights, i.e. the output of serialize_pop, or
+                a (P, NUM_WEIGHTS) array of the flattened weights of each agent
+        """
+        if isinstance(weights, np.ndarray):
+            self.weights = np.array(weights, dtype=np.float32, order='C')
+        else:
+            self.weights = np.empty((len(weights), NUM_WEIGHTS), 
+                dtype=np.float32)
+            for row, agent_weights in zip(self.weights, weights):
+                row[:] = flatten_weights(agent_weights)
+        # views of the weights of each layer, stacked over the agents
+        self.w1, self.b1, self.w2, self.b2 = self._layers(self.weights)
+        self.versions = [ next(_weights_versions) for _ in self.weights ]
+        self.agents = [ PopulationAgent(self, i) for i in range(len(self)) ]
+        self._model = None # keras model used by fit
+
+    @staticmethod
+    def _layers(weights):
+        """ views of the weights of each layer in the flattened weights """
+        layers = []
+        start = 0
+        for shape, size in zip(WEIGHT_SHAPES, WEIGHT_SIZES):
+            layers.append(weights[..., start:start+size].reshape(
+                weights.shape[:-1] + shape))
+            start += size
+        return layers
+
+    @classmethod
+    def from_models(cls, models):
+        return cls([ model.get_weights() for model in models ])
+
+    @classmethod
+    def random(cls, pop_size, rng=None):
+        """ a population of new agents, see random_weights """
+        if rng is None:
+            rng = np.random.default_rng()
+        return cls([ random_weights(rng) for _ in range(pop_size) ])
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __iter__(self):
+        return iter(self.agents)
+
+    def __getitem__(self, index):
+        return self.agents[index]
+
+    def agent(self, index):
+        """ a model like object for a single agent of the population """
+        return self.agents[index]
+
+    def get_weights(self, index):
+        return [ layer.copy() for layer in self._layers(self.weights[index]) ]
+
+    def set_weights(self, index, weights):
+        for layer, w in zip(self._layers(self.weights[index]), weights):
+            layer[...] = w
+        self.versions[index] = next(_weights_versions)
+
+    def fit(self, index, *args, **kwargs):
+        """ trains an agent with keras.Model.fit. The weights are copied into
+            a keras model built the first time it is needed and copied back
+            once trained. The model is compiled again before every fit, so no
+            optimizer state is carried over from the training of another 
+            agent """
+        if self._model is None:
+            self._model = generate_model()
+        else:
+            self._model.compile(
+                optimizer='adam',
+                loss='mean_squared_error',
+                metrics=['mean_squared_error']
+            )
+        self._model.set_weights(self.get_weights(index))
+        history = self._model.fit(*args, **kwargs)
+        self.set_weights(index, self._model.get_weights())
+        return history
+
+    def predict(self, indices, imgs):
+        """ scores each image with the agent of the same position in indices
+
+        Args:
+            indices: numpy.ndarray
+                the index of the agent that scores each image
+            imgs: numpy.ndarray
+                (N, 64, 2) array of images
+
+        Returns:
+            (N, 1) array of scores
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        imgs = np.asarray(imgs, dtype=np.float32)
+        if len(imgs) == 0:
+            return np.zeros((0, 1), dtype=np.float32)
+        imgs = imgs.reshape(len(imgs), -1)
+        # lay the images out as (agents, images per agent, 128), padding the
+        # agents with fewer images with zeros
+        agents, group, counts = np.unique(indices, return_inverse=True, 
+            return_counts=True)
+        order = np.argsort(group, kind='stable')
+        starts = np.cumsum(counts) - counts
+        rank = np.empty(len(imgs), dtype=np.intp)
+        rank[order] = np.arange(len(imgs)) - starts[group[order]]
+        stacked = np.zeros((len(agents), counts.max(), imgs.shape[1]), 
+            dtype=np.float32)
+        stacked[group, rank] = imgs
+        hidden = np.einsum('ami,aij->amj', stacked, self.w1[agents])
+        hidden += self.b1[agents][:, None, :]
+        scores = np.einsum('amj,ajk->amk', hidden, self.w2[agents])
+        scores += self.b2[agents][:, None, :]
+        return scores[group, rank]
+
+class PopulationAgent(object):
+    """ A single agent of a Population, which can stand in for its model 
+        anywhere only predict, fit, get_weights or set_weights are used """
+    def __init__(self, population, index):
+        self.population = population
+        self.index = index
+
+    @property
+    def version(self):
+        return self.population.versions[self.index]
+
+    def get_weights(self):
+        return self.population.get_weights(self.index)
+
+    def set_weights(self, weights):
+        self.population.set_weights(self.index, weights)
+
+    def fit(self, *args, **kwargs):
+        return self.population.fit(self.index, *args, **kwargs)
+
+    def predict(self, imgs):
+        return self.population.predict(np.full(len(imgs), self.index), imgs)
+
+class EvaluationCache(object):
+    """ Least recently used cache of the scores models give to images.
+
+    Scores are kept per model weights version (see NumpyModel and 
+    PopulationAgent), so one cache can be shared by every agent of a 
+    population. The key of an image is the position it shows from the
+    perspective of the player who moved. If symmetric is True, then the key
+    is the canonical form of that position among its 8 symmetries (see 
+    libs/symmetry), so symmetric positions share a score. The network is not
+    symmetry invariant, so this changes the scores and is off by default.
+    """
+    def __init__(self, maxsize=2**18, symmetric=False):
+        self.maxsize = maxsize
+        self.symmetric = symmetric
+        self.scores = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.scores)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def keys(self, model, imgs):
+        """ the keys of the images scored by the given model """
+        version = model.version
+        # the own and the opponent's squares as 8 bytes each
+        masks = np.packbits(np.asarray(imgs).transpose(0, 2, 1) > 0.5, 
+            axis=2, bitorder='little').reshape(-1, 16)
+        if self.symmetric:
+            own, opp = masks.copy().view('<u8').T.tolist()
+            return [ (version,) + canonical(o, p)[:2] 
+                     for o, p in zip(own, opp) ]
+        data = masks.tobytes()
+        return [ (version, data[i:i+16]) for i in range(0, len(data), 16) ]
+
+    def lookup(self, keys):
+        """ the cached score of each key, numpy.nan for those not cached """
+        scores = np.full(len(keys), np.nan, dtype=np.float32)
+        for i, key in enumerate(keys):
+            score = self.scores.get(key)
+            if score is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.scores.move_to_end(key)
+                scores[i] = score
+        return scores
+
+    def store(self, keys, scores):
+        for key, score in zip(keys, np.ravel(scores)):
+            self.scores[key] = float(score)
+            self.scores.move_to_end(key)
+        while len(self.scores) > self.maxsize:
+            self.scores.popitem(last=False)
+
+    def predict(self, model, imgs):
+        """ scores the images like model.predict, only calling the model for
+            the images that are not cached """
+        keys = self.keys(model, imgs)
+        scores = self.lookup(keys)
+        missed = np.isnan(scores)
+        if missed.any():
+            scores[missed] = np.ravel(model.predict(np.asarray(imgs)[missed]))
+            self.store([ key for key, miss in zip(keys, missed) if miss ],
+                scores[missed])
+        return scores.reshape(-1, 1)
+
+''' GENETIC OPERATORS 
+work on the weights of generate_model as numpy arrays, either those of a 
+single agent or stacked ones with leading dimensions for many agents '''
+def _random_subsets(rng, sizes, n):
+    """ masks of shape sizes.shape + (n,), each with the number of True 
+        values given by sizes at random positions """
+    ranks = np.broadcast_to(np.arange(n), sizes.shape + (n,)).copy()
+    return rng.permuted(ranks, axis=-1) < sizes[..., None]
+
+def mutate_weights(weights, rng=None):
+    """ replaces a random number (at least 1) of the kernel weights of each
+        agent with random values in [-1, 1), like experiment2.mutate did one
+        weight at a time. The biases are left unchanged
+
+    Args:
+        weights: list<numpy.ndarray>
+            [ kernel (..., 128, 16), bias, kernel (..., 16, 1), bias ]
+        rng: numpy.random.Generator
+            Optional; the generator to use, so results can be reproduced
+
+    Returns:
+        the mutated copy of the weights
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    w1, b1, w2, b2 = [ np.array(w, dtype=np.float32) for w in weights ]
+    batch = w1.shape[:-2]
+    size1 = w1.shape[-2] * w1.shape[-1]
+    # both kernels as one row of 128*16 + 16 weights per agent
+    flat = np.concatenate([ w1.reshape(batch + (-1,)), 
+                            w2.reshape(batch + (-1,)) ], axis=-1)
+    n = flat.shape[-1]
+    mask = _random_subsets(rng, rng.integers(1, n, size=batch), n)
+    flat[mask] = rng.uniform(-1, 1, size=np.count_nonzero(mask))
+    w1 = flat[..., :size1].reshape(w1.shape)
+    w2 = flat[..., size1:].reshape(w2.shape)
+    return [ w1, b1, w2, b2 ]
+
+def reproduce_weights(mother, father, rng=None):
+    """ crosses the weights of the mother with the father's: every row of 
+        the first kernel and the second kernel take a random number (0 to 15)
+        of their 16 weights from the father, like experiment2.reproduce did 
+        one weight at a time. The biases are the mother's
+
+    Args:
+        mother, father: list<numpy.ndarray>
+            [ kernel (..., 128, 16), bias, kernel (..., 16, 1), bias ]
+        rng: numpy.random.Generator
+            Optional; the generator to use, so results can be reproduced
+
+    Returns:
+        the weights of the child
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    m1, mb1, m2, mb2 = [ np.asarray(w, dtype=np.float32) for w in mother ]
+    f1, _, f2, _ = [ np.asarray(w, dtype=np.float32) for w in father ]
+    batch = m1.shape[:-2]
+    width = m1.shape[-1]
+    mask1 = _random_subsets(rng, rng.integers(0, width, size=m1.shape[:-1]), 
+        width)
+    mask2 = _random_subsets(rng, rng.integers(0, width, size=batch), width)
+    return [ np.where(mask1, f1, m1), mb1.copy(), 
+             np.where(mask2[..., None], f2, m2), mb2.copy() ]
 
 def generate_model():
     '''generate the standard model used for this othello game'''
+    # imported here, so modules that only need the numpy models (and the 
+    # search-only tools importing them) do not wait for TensorFlow to load
+    from tensorflow import keras
     model = keras.Sequential([
         keras.layers.Flatten(input_shape=(8*8, 2)),
         keras.layers.Dense(16),
@@ -41,17 +435,11 @@ def generate_model():
     )
     return model
 
-from libs.util import ProgressBar
 
 def generate_population(pop_size=16):
-    '''Generate a population of models of size pop_size'''
+    '''Generate a Population of new agents of size pop_size'''
     print(f"generating population with size {pop_size}...")
-    bar = ProgressBar(pop_size)
-    population = []
-    for _ in range(pop_size):
-        population.append(generate_model())
-        bar.update()
-    return population
+    return Population.random(pop_size)
 
 
 ''' SERIALIZATION OF DATA '''
@@ -60,14 +448,34 @@ def serialize_pop(population):
     return [ agent.get_weights() for agent in population ]
 
 def deserialize_pop(serialized_pop):
-    pop_size = len(serialized_pop)
-    population = generate_population(pop_size)
     print(f"Deserializing pop data...")
-    bar = ProgressBar(pop_size)
-    for agent, weights in zip(population, serialized_pop):
-        agent.set_weights(weights)
-        bar.update()
-    return population
+    return Population(serialized_pop)
+
+
+''' CHECKPOINTS '''
+from libs.checkpoint import save_checkpoint, load_checkpoint, load_top_k
+
+def checkpoint_population(path, population, generation_num, agent2score=None):
+    """ saves the weights of the agents in the order of population, along
+        with their scores if given, as a checkpoint (see libs/checkpoint) """
+    weights = np.stack([ 
+        agent.population.weights[agent.index] 
+        if isinstance(agent, PopulationAgent) 
+        else flatten_weights(agent.get_weights())
+        for agent in population 
+    ])
+    scores = None
+    if agent2score is not None:
+        scores = [ agent2score[agent] for agent in population ]
+    save_checkpoint(path, weights, generation_num, WEIGHT_SHAPES, scores)
+
+def load_population(path, k=None):
+    """ loads the Population of a checkpoint, or only its top k agents """
+    if k is None:
+        weights, header = load_checkpoint(path)
+    else:
+        weights, header = load_top_k(path, k)
+    return Population(weights)
 
 
 def calc_top_k(population, agent2score, p=0.2):
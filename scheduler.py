@@ -0,0 +1,118 @@
+'''
+MATCH SCHEDULER
+plays the independent matches of a round between the agents of a population 
+over a pool of worker processes
+'''
+import os
+import math
+import concurrent.futures
+
+
+''' WORKER PROCESSES '''
+# set in each worker process by _init_worker
+_agent_players = None
+
+def _init_worker(weights, cache_size):
+    ''' creates the players of the population once per worker. Only the 
+        serialized weights are sent, never the keras models '''
+    global _agent_players
+    from players import ModelPlayer
+    from research import Population, EvaluationCache, state2img, states2imgs
+    from libs.othellogame import makemove
+    population = Population(weights)
+    # the scores are kept per agent, so all of them share one cache
+    cache = EvaluationCache(cache_size) if cache_size else None
+    _agent_players = [
+        ModelPlayer(population.agent(i), makemove, state2img, states2imgs,
+            cache=cache)
+        for i in range(len(population))
+    ]
+
+def _play_chunk(matches, record):
+    ''' plays the matches (pairs of agent indices) of a chunk at the same 
+        time '''
+    from play import play_matches
+    return play_matches([
+        (_agent_players[black], _agent_players[white]) 
+        for black, white in matches
+    ], record=record)
+
+
+class MatchScheduler(object):
+    """ Plays matches between the agents of a population on worker processes.
+
+    The matches are split into chunks that are handed to the workers, which 
+    play the matches of a chunk at the same time like play_matches. The 
+    results are put back in the order of the matches, so they do not depend on
+    which worker finishes first.
+
+    e.g.:
+    >>> with MatchScheduler(serialize_pop(population)) as scheduler:
+    ...     results = scheduler.play([ (0, 1), (1, 0) ])
+    """
+    def __init__(self, weights, max_workers=None, chunks_per_worker=4,
+                 cache_size=0):
+        """
+        Args:
+            weights: list<list<numpy.ndarray>>
+                the weights of each agent, i.e. the output of serialize_pop
+            max_workers: int
+                Optional; the number of worker processes. Defaults to the
+                number of processors
+            chunks_per_worker: int
+                the matches are split in about this many chunks per worker, 
+                so the progress bar is updated more often and workers that
+                finish early get more work
+            cache_size: int
+                Optional; if given, then each worker keeps the scores of up to
+                this many positions in an EvaluationCache, which lasts for all
+                the rounds played by the scheduler
+        """
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(weights, cache_size))
+        self.num_chunks = (max_workers or os.cpu_count()) * chunks_per_worker
+
+    def close(self):
+        """ shuts the worker processes down """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def play(self, matches, record=False, bar=None):
+        """ plays the matches on the worker processes
+
+        Args:
+            matches: list<(int, int)>
+                the indices of the black and white agent of each match
+            record: bool
+                Optional; if True, then the moves of every match are recorded
+                like in play_matches
+            bar: ProgressBar
+                Optional; updated with the number of matches of every chunk 
+                that finishes
+
+        Returns:
+            the same as play_matches, in the order of the matches
+        """
+        size = max(1, math.ceil(len(matches) / self.num_chunks))
+        future2start = {
+            self.executor.submit(_play_chunk, matches[start:start+size], 
+                record): start
+            for start in range(0, len(matches), size)
+        }
+        results = [ None ] * len(matches)
+        for future in concurrent.futures.as_completed(future2start):
+            start = future2start[future]
+            chunk = future.result()
+            results[start:start+len(chunk)] = chunk
+            if bar is not None:
+                bar.update(len(chunk))
+        return results